@@ -1,4 +1,3 @@
-import datetime
 import os
 import sys
 import subprocess
@@ -15,6 +14,7 @@ import numpy as np
 
 
 import utils.dashboard
+import utils.data_access
 
 #===== Page Config ==============================================================================================
 st.set_page_config(
@@ -50,10 +50,13 @@ background: linear-gradient(0deg, rgba(251,253,255,1) 43%, rgba(246,251,255,1) 1
 )
 
 #===== Data ==============================================================================================
-df = pd.read_parquet("data/processed/data_building_n.parquet")
-rooms = sorted(df["room"].unique())
+dataset_dir = "data/processed/data_building_n.parquet"
+sensors = ["tmp", "hum", "CO2", "VOC"]
+# All readings sorted by room and time, a room (and time range) is selected as a slice
+room_index = utils.data_access.read_room_index(dataset_dir, columns=sensors)
+rooms = room_index.rooms
 
-room_info = pd.read_parquet("data/processed/room_information.parquet")
+room_info = utils.data_access.read_room_information()
 
 #===== Simulation Date ==============================================================================================
 with st.container(border=True):
@@ -64,8 +67,7 @@ with st.container(border=True):
     
     with room_col:
         room = st.selectbox("Room", rooms)
-        df_room = df[(df["room"]==room) & (df["date_time"] <= simulation_date)]
-        df_room = df_room.sort_values("date_time", ascending=False)
+        df_room = room_index.slice(room, end=simulation_date)
         room_info = room_info[(room_info["room"]==room) & (room_info["building"] == "N")]
 
 #===== Room Infos ==============================================================================================
@@ -103,16 +105,11 @@ with st.container(border=True):
     with col3:
         with st.container(border=True):
             icon_col, status_col = st.columns([1, 5], vertical_alignment="top")
-            time_diff = simulation_date - df_room["date_time"].max()
-            if time_diff <= pd.Timedelta(days=1):
-                status = "Good"
-                icon_path = "Dashboard/assets/good.png"
-            elif pd.Timedelta(days=1) < time_diff <= pd.Timedelta(days=2):
-                status = "Warning"
-                icon_path = "Dashboard/assets/warning.png"
-            else:
-                status = "Critical"
-                icon_path = "Dashboard/assets/critical.png"
+            # Status of all devices from the health table, see the Health page
+            device_status = utils.data_access.read_device_status(simulation_date, dataset_dir=dataset_dir)
+            time_diff = device_status["since"].get(room, pd.NaT)
+            status = device_status["status"].get(room, "Critical")
+            icon_path = f"Dashboard/assets/{status.lower()}.png"
 
             with icon_col:
                 st.image(icon_path)
@@ -130,25 +127,11 @@ with st.container(border=True):
 
 #===== Metrics ==============================================================================================
 # Metrics over the last 24 hours
-tmp_max = round(df_room[df_room["date_time"] >= simulation_date - datetime.timedelta(days=1)]["tmp"].max(), 2)
-tmp_min = round(df_room[df_room["date_time"] >= simulation_date - datetime.timedelta(days=1)]["tmp"].min(), 2)
-tmp_mean = round(df_room[df_room["date_time"] >= simulation_date - datetime.timedelta(days=1)]["tmp"].mean(), 2)
-tmp_mean_before = round(df_room[(df_room["date_time"] >= simulation_date - datetime.timedelta(days=2)) & (df_room["date_time"] <= simulation_date - datetime.timedelta(days=1))]["tmp"].mean(), 2)
-
-co2_max = round(df_room[df_room["date_time"] >= simulation_date - datetime.timedelta(days=1)]["CO2"].max(), 2)
-co2_min = round(df_room[df_room["date_time"] >= simulation_date - datetime.timedelta(days=1)]["CO2"].min(), 2)
-co2_mean = round(df_room[df_room["date_time"] >= simulation_date - datetime.timedelta(days=1)]["CO2"].mean(), 2)
-co2_mean_before = round(df_room[(df_room["date_time"] >= simulation_date - datetime.timedelta(days=2)) & (df_room["date_time"] <= simulation_date - datetime.timedelta(days=1))]["CO2"].mean(), 2)
-
-hum_max = round(df_room[df_room["date_time"] >= simulation_date - datetime.timedelta(days=1)]["hum"].max(), 2)
-hum_min = round(df_room[df_room["date_time"] >= simulation_date - datetime.timedelta(days=1)]["hum"].min(), 2)
-hum_mean = round(df_room[df_room["date_time"] >= simulation_date - datetime.timedelta(days=1)]["hum"].mean(), 2)
-hum_mean_before = round(df_room[(df_room["date_time"] >= simulation_date - datetime.timedelta(days=2)) & (df_room["date_time"] <= simulation_date - datetime.timedelta(days=1))]["hum"].mean(), 2)
-
-voc_max = round(df_room[df_room["date_time"] >= simulation_date - datetime.timedelta(days=1)]["VOC"].max(), 2)
-voc_min = round(df_room[df_room["date_time"] >= simulation_date - datetime.timedelta(days=1)]["VOC"].min(), 2)
-voc_mean = round(df_room[df_room["date_time"] >= simulation_date - datetime.timedelta(days=1)]["VOC"].mean(), 2)
-voc_mean_before = round(df_room[(df_room["date_time"] >= simulation_date - datetime.timedelta(days=2)) & (df_room["date_time"] <= simulation_date - datetime.timedelta(days=1))]["VOC"].mean(), 2)
+stats = utils.dashboard.window_stats(df_room, simulation_date, sensors)
+tmp_max, tmp_min, tmp_mean, tmp_mean_before = stats["tmp"]
+co2_max, co2_min, co2_mean, co2_mean_before = stats["CO2"]
+hum_max, hum_min, hum_mean, hum_mean_before = stats["hum"]
+voc_max, voc_min, voc_mean, voc_mean_before = stats["VOC"]
 
 left_metrics, right_metrics = st.columns([1, 1])
 with left_metrics:
@@ -211,16 +194,20 @@ with st.container(border=True):
         elif sensor_selected == "Humidity":
             sensor_selected = "hum"
         
-    fig = utils.dashboard.get_main_fig(df_room, search_start, search_end, sensor_selected)
+    # Min/max per pixel column instead of hourly or daily means, so short CO2 peaks stay visible
+    fig = utils.dashboard.get_main_fig(df_room, search_start, search_end, sensor_selected, downsample="minmax", max_points=1000)
     st.plotly_chart(fig, use_container_width=True)
 
 
 #===== Tachos ==============================================================================================
+df = room_index.df
+room_stats = utils.data_access.read_room_stats(sensors, dataset_dir)
+
 left_metrics, right_metrics = st.columns([1, 1])
 with left_metrics:
     with st.container(border=True):
         st.markdown("<center><h3 style='margin-bottom:-20px'>Temperature (in °C)</h3></center>", unsafe_allow_html=True)
-        fig, percentile = utils.dashboard.get_tacho(df, room, "tmp", "rgb(74, 85, 162)", "rgb(197, 223, 248)")
+        fig, percentile = utils.dashboard.get_tacho(df, room, "tmp", "rgb(74, 85, 162)", "rgb(197, 223, 248)", room_stats=room_stats)
         st.plotly_chart(fig, use_container_width=True)
         if percentile < 50:
             st.markdown(f"<p style='margin-top:-50px; text-align: center;'>The average temperature for this room is lower than in <b>{100-percentile} %</b> of all rooms.</p>", unsafe_allow_html=True)
@@ -229,7 +216,7 @@ with left_metrics:
     
     with st.container(border=True):
         st.markdown("<center><h3 style='margin-bottom:-20px'>CO2 (in ppm)</h3></center>", unsafe_allow_html=True)
-        fig, percentile = utils.dashboard.get_tacho(df, room, "CO2", "rgb(74, 85, 162)", "rgb(197, 223, 248)")
+        fig, percentile = utils.dashboard.get_tacho(df, room, "CO2", "rgb(74, 85, 162)", "rgb(197, 223, 248)", room_stats=room_stats)
         st.plotly_chart(fig, use_container_width=True)
         if percentile < 50:
             st.markdown(f"<p style='margin-top:-50px; text-align: center;'>The average CO2 concentration for this room is lower than in <b>{100-percentile} %</b> of all rooms.</p>", unsafe_allow_html=True)
@@ -240,7 +227,7 @@ with left_metrics:
 with right_metrics:
     with st.container(border=True):
         st.markdown("<center><h3 style='margin-bottom:-20px'>Humidity (in %)</h3></center>", unsafe_allow_html=True)
-        fig, percentile = utils.dashboard.get_tacho(df, room, "hum", "rgb(74, 85, 162)", "rgb(197, 223, 248)")
+        fig, percentile = utils.dashboard.get_tacho(df, room, "hum", "rgb(74, 85, 162)", "rgb(197, 223, 248)", room_stats=room_stats)
         st.plotly_chart(fig, use_container_width=True)
         if percentile < 50:
             st.markdown(f"<p style='margin-top:-50px; text-align: center;'>The average humidity for this room is lower than in <b>{100-percentile} %</b> of all rooms.</p>", unsafe_allow_html=True)
@@ -249,7 +236,7 @@ with right_metrics:
     
     with st.container(border=True):
         st.markdown("<center><h3 style='margin-bottom:-20px'>VOC (in ppb)</h3></center>", unsafe_allow_html=True)
-        fig, percentile = utils.dashboard.get_tacho(df, room, "VOC", "rgb(74, 85, 162)", "rgb(197, 223, 248)")
+        fig, percentile = utils.dashboard.get_tacho(df, room, "VOC", "rgb(74, 85, 162)", "rgb(197, 223, 248)", room_stats=room_stats)
         st.plotly_chart(fig, use_container_width=True)
         if percentile < 50:
             st.markdown(f"<p style='margin-top:-50px; text-align: center;'>The average VOC concentration for this room is lower than in <b>{100-percentile} %</b> of all rooms.</p>", unsafe_allow_html=True)
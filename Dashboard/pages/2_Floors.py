@@ -1,9 +1,21 @@
 import itertools
+import os
+import subprocess
+import sys
+
+current_dir = os.getcwd()
+git_root = subprocess.check_output(["git", "rev-parse", "--show-toplevel"], cwd=current_dir)
+git_root = git_root.decode("utf-8").strip()
+os.chdir(git_root)
+sys.path.append(git_root)
+
 import streamlit as st
-import pandas as pd
 import altair as alt
 import matplotlib.pyplot as plt 
 
+import utils.dashboard
+import utils.data_access
+
 st.set_page_config(
     page_title="Floors",
     layout="wide",
@@ -35,9 +47,10 @@ background: linear-gradient(0deg, rgba(251,253,255,1) 43%, rgba(246,251,255,1) 1
     unsafe_allow_html=True
 )
 
-data = pd.read_parquet("data/processed/data_building_n.parquet")
-
-data['date'] = pd.to_datetime(data['date'])
+# The charts are computed from the hourly and daily rollups, the readings are only read for the scatterplots
+dataset_dir = "data/processed/data_building_n.parquet"
+data = utils.data_access.read_rollup("hourly", dataset_dir, parse_dates=True)
+data_daily = utils.data_access.read_rollup("daily", dataset_dir, parse_dates=True)
 
 # --------------------------Sidebar Filter ------------------------
 
@@ -45,9 +58,11 @@ data['date'] = pd.to_datetime(data['date'])
 st.sidebar.title("Filter")
 floors = sorted(list(data["floor"].unique()))
 selected_floors = st.sidebar.multiselect('Floor', floors)
+selected_rooms = []
 
 if selected_floors:
     data = data[data["floor"].isin(selected_floors)]
+    data_daily = data_daily[data_daily["floor"].isin(selected_floors)]
 
 # Dynamischer Filter für Raum (nur die Räume anzeigen, die zu den ausgewählten Etagen gehören)
 if selected_floors:
@@ -56,6 +71,7 @@ if selected_floors:
 
     if selected_rooms:
         data = data[data['room'].isin(selected_rooms)]
+        data_daily = data_daily[data_daily['room'].isin(selected_rooms)]
 
 # Filter für Season
 seasons = data['season'].unique()
@@ -63,6 +79,7 @@ selected_seasons = st.sidebar.multiselect('Season', seasons, seasons, format_fun
 
 if selected_seasons:
     data = data[data["season"].isin(selected_seasons)]
+    data_daily = data_daily[data_daily["season"].isin(selected_seasons)]
 
 # Filter für Wochentag (day_of_week)
 days_of_week_mapping = {
@@ -78,9 +95,11 @@ days_of_week_mapping = {
 days_of_week = sorted(list(data["day_of_week"].unique()))
 selected_days_of_week = st.sidebar.multiselect('Weekday', [days_of_week_mapping[d] for d in days_of_week], [days_of_week_mapping[d] for d in days_of_week])
 
+selected_days_of_week_indices = []
 if selected_days_of_week:
     selected_days_of_week_indices = [k for k, v in days_of_week_mapping.items() if v in selected_days_of_week]
     data = data[data['day_of_week'].isin(selected_days_of_week_indices)]
+    data_daily = data_daily[data_daily['day_of_week'].isin(selected_days_of_week_indices)]
 
 
 #---------------------- Metrik berechnen ------------------------------------------
@@ -94,6 +113,11 @@ selected_outside_metrics = st.sidebar.multiselect('Weather Data (outside)', outs
 
 selected_metrics = selected_inside_metrics + selected_outside_metrics
 
+# Means of all metrics per hour and per date, computed once per filter combination and shared by all charts
+means_by_hour, means_by_date = utils.data_access.read_filtered_means(
+    selected_floors, selected_rooms, selected_seasons, selected_days_of_week_indices, dataset_dir
+)
+
 if len(selected_metrics) > 0:
     if len(selected_floors) > 1:
         st.title(f"Floors: {', '.join(selected_floors)}")
@@ -113,7 +137,7 @@ if len(selected_metrics) > 0:
         with st.container(border=True):
             st.subheader(f'{metric.upper()}')
 
-            avg_metrics_per_hour = data.groupby('hour')[metric].mean().reset_index()
+            avg_metrics_per_hour = means_by_hour[['hour', metric]]
             line_chart_hourly = alt.Chart(avg_metrics_per_hour).mark_line().encode(
                 x='hour:N',
                 y=alt.Y(f'mean({metric}):Q', title=f'{metric}'),
@@ -125,11 +149,7 @@ if len(selected_metrics) > 0:
             )
 
             # Gesamtverlauf
-            avg_metrics_total = data.groupby('date')[metric].mean().reset_index()
-            
-            # Resample on daily basis
-            avg_metrics_total = avg_metrics_total.set_index('date').resample('D').mean().reset_index()
-            data[metric] = data[metric].where(pd.notnull(data[metric]), None)
+            avg_metrics_total = means_by_date[['date', metric]]
 
             line_chart_total = alt.Chart(avg_metrics_total).mark_line(interpolate='linear').encode(
                 x='date:T',
@@ -154,8 +174,8 @@ if len(selected_metrics) > 1:
     # Auswahloption für den y-Wert hinzufügen
     comparison_type = st.radio("Select comparison type", ("Daily course", "Overall course"), key='comparison_type')
 
-    def combine_metrics_by_hour(data, metrica, metricb):
-        combined_data = data.groupby('hour')[[metrica, metricb]].mean().reset_index()
+    def combine_metrics_by_hour(means_by_hour, metrica, metricb):
+        combined_data = means_by_hour[['hour', metrica, metricb]]
         base = alt.Chart(combined_data).encode(x='hour:N')
 
         line1 = base.mark_line(color='blue').encode(
@@ -176,8 +196,8 @@ if len(selected_metrics) > 1:
 
         return chart
 
-    def combine_metrics_by_date(data, metrica, metricb):
-        combined_data = data[['date', metrica, metricb]].set_index('date').resample('D').mean().reset_index()
+    def combine_metrics_by_date(means_by_date, metrica, metricb):
+        combined_data = means_by_date[['date', metrica, metricb]]
         base = alt.Chart(combined_data).encode(x='date:T')
 
         line1 = base.mark_line(color='blue').encode(
@@ -199,28 +219,45 @@ if len(selected_metrics) > 1:
         return chart
 
     if comparison_type == "Daily course":
-        chart_hour = combine_metrics_by_hour(data, metrica, metricb)
+        chart_hour = combine_metrics_by_hour(means_by_hour, metrica, metricb)
         st.altair_chart(chart_hour, use_container_width=True)
     else:
-        chart_date = combine_metrics_by_date(data, metrica, metricb)
+        chart_date = combine_metrics_by_date(means_by_date, metrica, metricb)
         st.altair_chart(chart_date, use_container_width=True)
 
 
 if len(selected_metrics) > 1:
-    show_scatterplots = st.checkbox('Show Scatterplots for correlation analysis')
+    show_scatterplots = st.checkbox('Show density plots for correlation analysis')
 
     if show_scatterplots:
+        # Readings of the rooms and days that passed the filters
+        readings = utils.data_access.read_dataset(dataset_dir, room=sorted(data_daily['room'].unique()), columns=['room', 'date'] + selected_metrics, parse_dates=True)
+        readings = readings.merge(data_daily[['room', 'date']], on=['room', 'date'])
+
+        # The readings are counted in bins on the server, only the bins (and optionally a sample) are sent to the browser
+        correlations = readings[selected_metrics].corr()
+        show_samples = st.checkbox('Show a sample of readings (with tooltips)')
+        if show_samples:
+            samples = utils.dashboard.stratified_sample(readings[['room'] + selected_metrics], 'room', 1000)
+
         with st.container(border=True):
-            st.title('Scatterplots of the selected metrics')
+            st.title('Density plots of the selected metrics')
             for metric1, metric2 in itertools.combinations(selected_metrics, 2):
                 st.subheader(f"{metric1.upper()} vs. {metric2.upper()}")
-                st.write(f"Correlation coefficient: {round(data[metric1].corr(data[metric2]), 3)}")
-                scatter_chart = alt.Chart(data).mark_circle().encode(
-                    x=metric1,
-                    y=metric2,
-                    tooltip=[metric1, metric2]
-                ).properties(
-                    width=400,
-                    height=300
+                st.write(f"Correlation coefficient: {round(correlations.loc[metric1, metric2], 3)}")
+                density = utils.dashboard.get_density(readings, metric1, metric2)
+                density_chart = alt.Chart(density).mark_rect().encode(
+                    x=alt.X('x_start:Q', bin='binned', title=metric1),
+                    x2='x_end:Q',
+                    y=alt.Y('y_start:Q', bin='binned', title=metric2),
+                    y2='y_end:Q',
+                    color=alt.Color('count:Q', scale=alt.Scale(type='log'), title='Readings'),
+                    tooltip=[alt.Tooltip('count:Q', title='Readings')]
                 )
-                st.altair_chart(scatter_chart)
\ No newline at end of file
+                if show_samples:
+                    density_chart = density_chart + alt.Chart(samples).mark_circle(size=12, color='black', opacity=0.4).encode(
+                        x=metric1,
+                        y=metric2,
+                        tooltip=['room', metric1, metric2]
+                    )
+                st.altair_chart(density_chart.properties(width=400, height=300))
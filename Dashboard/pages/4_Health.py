@@ -0,0 +1,111 @@
+import os
+import subprocess
+import sys
+
+current_dir = os.getcwd()
+git_root = subprocess.check_output(["git", "rev-parse", "--show-toplevel"], cwd=current_dir)
+git_root = git_root.decode("utf-8").strip()
+os.chdir(git_root)
+sys.path.append(git_root)
+
+import streamlit as st
+import pandas as pd
+
+import utils.data_access
+import utils.events
+import utils.health
+
+st.set_page_config(
+    page_title="Health",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
+
+st.markdown(
+    """
+    <style>
+    /* Hintergrundfarbe für die gesamte Seite */
+    .stApp {
+    background: rgb(251,253,255);
+background: linear-gradient(0deg, rgba(251,253,255,1) 43%, rgba(246,251,255,1) 100%);
+    }
+
+    /* Beispiel für benutzerdefinierte Abschnitte */
+    .st-emotion-cache-4uzi61 {
+        background-color: #ffffff;  /* Hintergrundfarbe für einen bestimmten Abschnitt */
+        border-color:#ffffff;
+        box-shadow: 0 0 5px rgba(0,0,0,0.1);  /* Schatten für einen bestimmten Abschnitt */
+    }
+
+    </style>
+    """,
+    unsafe_allow_html=True
+)
+
+# The status of all devices is read from the health table (utils/health.py), not from the readings
+dataset_dir = "data/processed/data_building_n.parquet"
+
+st.sidebar.title("Filter")
+simulation_date = pd.Timestamp(st.sidebar.date_input("Simulation Date", value=pd.Timestamp("2022-09-23")))
+window_days = st.sidebar.number_input("Window (days)", min_value=1, max_value=30, value=1)
+selected_statuses = st.sidebar.multiselect("Status", utils.health.STATUSES, utils.health.STATUSES)
+
+device_status = utils.data_access.read_device_status(simulation_date, pd.Timedelta(days=window_days), dataset_dir)
+
+st.title("Device Health")
+
+# Number of devices per status
+with st.container(border=True):
+    counts = device_status["status"].value_counts()
+    for col, status in zip(st.columns(len(utils.health.STATUSES)), utils.health.STATUSES):
+        col.metric(status, int(counts.get(status, 0)))
+
+with st.container(border=True):
+    table = device_status[device_status["status"].isin(selected_statuses)].reset_index()
+    table["since"] = (table["since"] / pd.Timedelta(hours=1)).round(1)
+    table["uplinks_per_hour"] = table["uplinks_per_hour"].round(2)
+    st.dataframe(
+        table,
+        column_config={
+            "room": "Room",
+            "status": "Status",
+            "last_seen": st.column_config.DatetimeColumn("Last seen", format="YYYY-MM-DD HH:mm"),
+            "since": "Hours since last reading",
+            "readings": f"Readings (last {window_days} days)",
+            "uplinks_per_hour": "Uplinks per hour",
+            "gaps": "Gaps > 1 h",
+        },
+        column_order=["room", "status", "last_seen", "since", "readings", "uplinks_per_hour", "gaps"],
+        hide_index=True,
+        use_container_width=True
+    )
+
+# CO2 episodes above the limits of the traffic light (utils/events.py) that started in the window
+co2_events = utils.data_access.read_co2_events(dataset_dir)
+co2_events = co2_events[
+    (co2_events["start"] >= simulation_date - pd.Timedelta(days=window_days)) & (co2_events["start"] < simulation_date)
+]
+
+st.title("CO2 Episodes")
+with st.container(border=True):
+    for col, threshold in zip(st.columns(len(utils.events.CO2_THRESHOLDS)), utils.events.CO2_THRESHOLDS):
+        episodes = co2_events[co2_events["threshold"] == threshold]
+        col.metric(f"Above {threshold} ppm", len(episodes), help=f"Rooms: {episodes['room'].nunique()}")
+
+with st.container(border=True):
+    table = co2_events.sort_values("start", ascending=False, ignore_index=True)
+    table["duration"] = (table["duration"] / pd.Timedelta(minutes=1)).round(0)
+    st.dataframe(
+        table,
+        column_config={
+            "room": "Room",
+            "threshold": "Threshold (ppm)",
+            "start": st.column_config.DatetimeColumn("Start", format="YYYY-MM-DD HH:mm"),
+            "end": st.column_config.DatetimeColumn("End", format="YYYY-MM-DD HH:mm"),
+            "duration": "Duration (min)",
+            "readings": "Readings",
+            "peak": "Peak (ppm)",
+        },
+        hide_index=True,
+        use_container_width=True
+    )
@@ -0,0 +1,80 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils.data_pipeline
+import utils.events
+import utils.health
+import utils.rollups
+import utils.storage
+import utils.weather
+
+DAT_HEADER = (
+    "# Logfile LoRaWAN TTN/TTS V3 logger version hka-log V 1.1\n"
+    "date_time;device_id;tmp;hum;CO2;VOC;vis;IR;WIFI;BLE;rssi;channel_rssi;snr;gateway;channel_index;spreading_factor;bandwidth;f_cnt\n"
+)
+
+def dat_line(date_time:str, room:str, f_cnt:int, tmp:float=22.5, hum:float=50.0, co2:int=600, voc:int=100) -> str:
+    """ One reading in the format of the logger. """
+    return (
+        f"{date_time}; hka-aqm-n{room};  {tmp:.2f};  {hum:.2f};   {co2};   {voc};   244;    46;     1;     0;"
+        f"   -77;   -77;   8.5; drag-lps8-01; 4; 7; 125000; {f_cnt}\n"
+    )
+
+def write_dat(data_dir:str, room:str, date:str, lines:list) -> str:
+    """ Write a .dat file of a room and day (YYYY-MM-DD) with the given reading lines. """
+    dat_dir = os.path.join(data_dir, "hka-aqm-n")
+    os.makedirs(dat_dir, exist_ok=True)
+    fpath = os.path.join(dat_dir, f"hka-aqm-n{room}_{date.replace('-', '_')}.dat")
+    with open(fpath, "w") as f:
+        f.write(DAT_HEADER + "".join(lines))
+    return fpath
+
+def day_lines(room:str, date:str, start_f_cnt:int=0, freq:str="15min", co2=None) -> list:
+    """ A reading every freq over the whole day, optionally with the given CO2 values. """
+    times = pd.date_range(date, periods=pd.Timedelta(days=1) // pd.Timedelta(freq), freq=freq)
+    co2 = [600] * len(times) if co2 is None else co2
+    return [dat_line(t.strftime("%Y-%m-%d %H:%M:%S"), room, start_f_cnt + i, co2=c) for i, (t, c) in enumerate(zip(times, co2))]
+
+def read_outputs(output_fpath:str) -> dict:
+    """ The processed data and all tables derived from it, in a comparable order. """
+    outputs = {
+        "data": utils.storage.read_dataset(output_fpath),
+        "health": pd.read_parquet(utils.health.health_fpath(output_fpath)),
+        "events": pd.read_parquet(utils.events.events_fpath(output_fpath)),
+    }
+    quality_fpath = os.path.join(os.path.dirname(output_fpath), "data_quality.parquet")
+    if os.path.exists(quality_fpath):
+        outputs["quality"] = pd.read_parquet(quality_fpath)
+    for resolution in utils.rollups.RESOLUTIONS:
+        outputs[resolution] = utils.rollups.read_rollup(output_fpath, resolution)
+    for name, df in outputs.items():
+        keys = [c for c in ["room", "device_id", "threshold", "date_time", "date", "start"] if c in df.columns]
+        outputs[name] = df.sort_values(keys, ignore_index=True)
+    return outputs
+
+def assert_outputs_equal(a:dict, b:dict) -> None:
+    """ Compare the outputs that exist in both. """
+    for name in set(a) & set(b):
+        pd.testing.assert_frame_equal(a[name], b[name], obj=name)
+
+@pytest.fixture
+def fake_weather(monkeypatch):
+    """ Replace the weather API with deterministic hourly values. """
+    def get_weather_data(start_date, end_date):
+        start = pd.Timestamp(start_date, tz=utils.weather.TIMEZONE).tz_convert("UTC")
+        end = pd.Timestamp(end_date, tz=utils.weather.TIMEZONE).tz_convert("UTC") + pd.Timedelta(days=1)
+        times = pd.date_range(start, end, freq="h", inclusive="left")
+        df = pd.DataFrame({"time": times})
+        hours = (times.asi8 // 3_600_000_000_000).astype(float)
+        for i, column in enumerate(utils.weather.WEATHER_COLUMNS):
+            df[column] = np.sin(hours * (i + 1) / 7).round(3)
+        df.insert(1, "hour_key", utils.weather.hour_key(df["time"]))
+        return df
+
+    monkeypatch.setattr(utils.data_pipeline, "get_weather_data", get_weather_data)
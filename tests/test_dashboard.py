@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils.dashboard
+
+def series(n:int, seed:int=0):
+    times = pd.date_range("2022-09-01", periods=n, freq="15min").to_numpy()
+    values = np.random.default_rng(seed).normal(800, 100, n)
+    return times, values
+
+@pytest.mark.parametrize("downsample", ["minmax", "lttb"])
+def test_short_series_are_kept(downsample):
+    times, values = series(50)
+    kept_times, kept_values = utils.dashboard.DOWNSAMPLING[downsample](times, values, 100)
+    assert np.array_equal(kept_times, times) and np.array_equal(kept_values, values)
+
+def test_minmax_keeps_the_extremes_of_every_bucket():
+    times, values = series(10000)
+    values[1234], values[5678] = 5000, 0
+    kept_times, kept_values = utils.dashboard.downsample_minmax(times, values, 100)
+
+    assert len(kept_times) <= 100
+    assert np.all(np.diff(kept_times) > np.timedelta64(0))
+    assert np.array_equal(values[np.searchsorted(times, kept_times)], kept_values)
+    assert {times[1234], times[5678]} <= set(kept_times)
+    assert kept_values.max() == 5000 and kept_values.min() == 0
+
+def test_lttb_keeps_the_ends_and_peaks():
+    times, values = series(10000)
+    values[4321] = 5000
+    kept_times, kept_values = utils.dashboard.downsample_lttb(times, values, 100)
+
+    assert len(kept_times) == 100
+    assert np.all(np.diff(kept_times) > np.timedelta64(0))
+    assert kept_times[0] == times[0] and kept_times[-1] == times[-1]
+    assert np.array_equal(values[np.searchsorted(times, kept_times)], kept_values)
+    assert times[4321] in set(kept_times)
+
+@pytest.mark.parametrize("downsample", ["minmax", "lttb"])
+def test_gap_markers_count_against_max_points(downsample):
+    times, values = series(10000)
+    # A day without readings every week
+    keep = (times - times[0]) % np.timedelta64(7, "D") >= np.timedelta64(1, "D")
+    df_room = pd.DataFrame({"date_time": times[keep], "CO2": values[keep]})
+    start, end = pd.Timestamp(times[0]), pd.Timestamp(times[-1])
+
+    df_data = utils.dashboard.downsampled_series(df_room, start, end, "CO2", downsample, 400)
+    assert len(df_data) <= 400
+    assert df_data.index.is_monotonic_increasing
+    gaps = df_data.index[df_data["CO2"].isna()]
+    assert len(gaps) == 14
+    # Every marker follows the last reading before a day without readings
+    assert np.all((gaps - start) % pd.Timedelta(days=7) == pd.Timedelta(days=7) - pd.Timedelta(minutes=15) + pd.Timedelta(seconds=1))
+
+def test_main_fig_resamples_readings_per_hour():
+    times, values = series(200)
+    df_room = pd.DataFrame({"date_time": times, "CO2": values})
+    start, end = pd.Timestamp("2022-09-01 00:00"), pd.Timestamp("2022-09-01 23:00")
+
+    fig = utils.dashboard.get_main_fig(df_room, start, end, "CO2")
+    expected = df_room[df_room["date_time"] <= end].set_index("date_time")["CO2"].resample("h").mean().round(2)
+    assert np.allclose(fig.data[-1].y, expected)
@@ -0,0 +1,74 @@
+import os
+
+import pandas as pd
+import pytest
+
+import utils.data_access
+import utils.storage
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    utils.data_access.clear()
+    yield
+    utils.data_access.clear()
+
+def readings(room:str, start:str, periods:int) -> pd.DataFrame:
+    return utils.storage.apply_schema(pd.DataFrame({
+        "date_time": pd.date_range(start, periods=periods, freq="15min"),
+        "room": pd.Categorical([room] * periods),
+        "CO2": 600.0,
+    }))
+
+def test_cached_frames_follow_dataset_changes(tmp_path):
+    dataset_dir = str(tmp_path / "d.parquet")
+    utils.storage.write_dataset(readings("002", "2022-09-01", 10), dataset_dir)
+    version = utils.data_access.data_version(dataset_dir)
+    assert len(utils.data_access.read_dataset(dataset_dir)) == 10
+    assert utils.data_access.read_dataset(dataset_dir) is utils.data_access.read_dataset(dataset_dir)
+
+    # Appending, compacting and deleting partitions each change the version
+    utils.storage.write_dataset(readings("002", "2022-09-02", 5), dataset_dir, append=True)
+    assert utils.data_access.data_version(dataset_dir) != version
+    assert len(utils.data_access.read_dataset(dataset_dir)) == 15
+
+    version = utils.data_access.data_version(dataset_dir)
+    utils.storage.compact_partitions(dataset_dir, [("002", "2022-09")])
+    assert utils.data_access.data_version(dataset_dir) != version
+
+    version = utils.data_access.data_version(dataset_dir)
+    utils.storage.delete_partitions(dataset_dir, [("002", "2022-09")])
+    assert utils.data_access.data_version(dataset_dir) != version
+
+def test_datasets_without_version_file_are_listed(tmp_path):
+    dataset_dir = str(tmp_path / "d.parquet")
+    utils.storage.write_dataset(readings("002", "2022-09-01", 10), dataset_dir)
+    os.remove(utils.storage.version_fpath(dataset_dir))
+    version = utils.data_access.data_version(dataset_dir)
+    utils.storage.write_dataset(readings("101", "2022-09-01", 10), dataset_dir)
+    os.remove(utils.storage.version_fpath(dataset_dir))
+    assert utils.data_access.data_version(dataset_dir) != version
+
+def test_cache_is_bounded_by_memory(tmp_path, monkeypatch):
+    fpath = str(tmp_path / "f.parquet")
+    pd.DataFrame({"a": [1]}).to_parquet(fpath)
+    frames = {n: pd.DataFrame({"a": range(n)}) for n in (1000, 2000, 100000)}
+    size = utils.data_access.memory_usage(frames[1000]) + utils.data_access.memory_usage(frames[2000])
+    monkeypatch.setattr(utils.data_access, "MAX_BYTES", size)
+
+    loads = []
+    def read(n):
+        def load():
+            loads.append(n)
+            return frames[n]
+        return utils.data_access.cached(("frame", n), fpath, load)
+
+    read(1000), read(2000), read(1000)
+    assert loads == [1000, 2000]
+
+    # The largest frame is kept on its own and displaces the others
+    read(100000), read(100000)
+    assert loads == [1000, 2000, 100000]
+    assert list(utils.data_access._cache) == [("frame", 100000)]
+    read(2000)
+    assert list(utils.data_access._cache) == [("frame", 2000)]
+    assert utils.data_access._cache_bytes == utils.data_access.memory_usage(frames[2000])
@@ -0,0 +1,140 @@
+import os
+import shutil
+
+import pandas as pd
+
+import utils.data_pipeline
+import utils.manifest
+import utils.storage
+from conftest import assert_outputs_equal, dat_line, day_lines, read_outputs, write_dat
+
+def write_first_day(data_dir:str) -> None:
+    lines = day_lines("002", "2022-09-01", co2=[600] * 40 + [900] * 8 + [1300] * 4 + [600] * 44)
+    # Out of range, rejected
+    lines.append(dat_line("2022-09-01 23:59:00", "002", 500, co2=0))
+    write_dat(data_dir, "002", "2022-09-01", lines)
+    write_dat(data_dir, "101", "2022-09-01", day_lines("101", "2022-09-01", start_f_cnt=1000))
+
+def write_second_day(data_dir:str) -> None:
+    lines = day_lines("002", "2022-09-02", start_f_cnt=200)
+    # A reading of the day before and an uplink that is already stored in the file of the day before
+    lines.insert(0, dat_line("2022-09-01 23:58:00", "002", 199))
+    lines.insert(1, dat_line("2022-09-01 00:00:00", "002", 0))
+    write_dat(data_dir, "002", "2022-09-02", lines)
+
+def test_incremental_runs_match_rebuild(tmp_path, fake_weather):
+    data_dir, output_fpath = str(tmp_path / "data"), str(tmp_path / "out" / "d.parquet")
+    os.makedirs(os.path.dirname(output_fpath))
+
+    write_first_day(data_dir)
+    utils.data_pipeline.pipeline(data_dir, output_fpath)
+    write_second_day(data_dir)
+    utils.data_pipeline.pipeline(data_dir, output_fpath)
+    # A file that grows during the day is replaced
+    with open(os.path.join(data_dir, "hka-aqm-n", "hka-aqm-n101_2022_09_01.dat"), "a") as f:
+        f.write(dat_line("2022-09-01 23:59:30", "101", 2000, co2=1500))
+    utils.data_pipeline.pipeline(data_dir, output_fpath)
+    incremental = read_outputs(output_fpath)
+
+    rebuild_fpath = str(tmp_path / "rebuild" / "d.parquet")
+    os.makedirs(os.path.dirname(rebuild_fpath))
+    utils.data_pipeline.pipeline(data_dir, rebuild_fpath)
+    assert_outputs_equal(incremental, read_outputs(rebuild_fpath))
+
+    # Chunked processing drops the duplicates across chunks against the stored data
+    chunked_fpath = str(tmp_path / "chunked" / "d.parquet")
+    os.makedirs(os.path.dirname(chunked_fpath))
+    utils.data_pipeline.pipeline(data_dir, chunked_fpath, chunk_size=1)
+    assert_outputs_equal(incremental, read_outputs(chunked_fpath))
+    # The files the chunks appended are merged
+    for room, ym in utils.storage.list_partitions(chunked_fpath):
+        assert len(os.listdir(utils.storage.partition_dir(chunked_fpath, room, ym))) == 1
+
+def test_quality_is_keyed_by_file_date(tmp_path, fake_weather):
+    data_dir, output_fpath = str(tmp_path / "data"), str(tmp_path / "out" / "d.parquet")
+    os.makedirs(os.path.dirname(output_fpath))
+    write_first_day(data_dir)
+    write_second_day(data_dir)
+    utils.data_pipeline.pipeline(data_dir, output_fpath)
+
+    quality = pd.read_parquet(os.path.join(tmp_path, "out", "data_quality.parquet")).set_index(["device_id", "date"])
+    assert len(quality) == 3
+    second_day = quality.loc[("hka-aqm-n002", pd.Timestamp("2022-09-02"))]
+    assert second_day["readings"] == 98
+    assert second_day["duplicate"] == 1
+    first_day = quality.loc[("hka-aqm-n002", pd.Timestamp("2022-09-01"))]
+    assert first_day["CO2_out_of_range"] == 1
+    assert first_day["rejected"] == 1
+
+def test_unreadable_file_is_not_retried_until_it_changes(tmp_path, fake_weather):
+    data_dir, output_fpath = str(tmp_path / "data"), str(tmp_path / "out" / "d.parquet")
+    os.makedirs(os.path.dirname(output_fpath))
+    write_first_day(data_dir)
+    utils.data_pipeline.pipeline(data_dir, output_fpath)
+    before = read_outputs(output_fpath)
+
+    # A V 1.0 header over V 1.1 rows can not be parsed
+    fpath = write_dat(data_dir, "005", "2022-09-01", day_lines("005", "2022-09-01"))
+    with open(fpath) as f:
+        content = f.read().replace("IR;WIFI;BLE;", "IR;")
+    with open(fpath, "w") as f:
+        f.write(content)
+
+    # The unreadable file is the only pending file
+    assert utils.data_pipeline.pipeline(data_dir, output_fpath)
+    assert_outputs_equal(before, read_outputs(output_fpath))
+    manifest = utils.manifest.read_manifest(os.path.join(tmp_path, "out", "manifest.parquet")).set_index("path")
+    assert manifest.loc[os.path.relpath(fpath), "rows"] == utils.manifest.FAILED_ROWS
+
+    _, changed, _ = utils.manifest.scan(os.path.join(data_dir, "hka-aqm-n"), manifest.reset_index())
+    assert changed == []
+
+    write_dat(data_dir, "005", "2022-09-01", day_lines("005", "2022-09-01"))
+    _, changed, _ = utils.manifest.scan(os.path.join(data_dir, "hka-aqm-n"), manifest.reset_index())
+    assert changed == [os.path.relpath(fpath)]
+
+def test_removed_files_are_removed_from_all_tables(tmp_path, fake_weather):
+    data_dir, output_fpath = str(tmp_path / "data"), str(tmp_path / "out" / "d.parquet")
+    os.makedirs(os.path.dirname(output_fpath))
+    write_first_day(data_dir)
+    write_dat(data_dir, "002", "2022-09-02", day_lines("002", "2022-09-02", start_f_cnt=200))
+    utils.data_pipeline.pipeline(data_dir, output_fpath)
+
+    os.remove(os.path.join(data_dir, "hka-aqm-n", "hka-aqm-n002_2022_09_02.dat"))
+    utils.data_pipeline.pipeline(data_dir, output_fpath)
+
+    rebuild_data = str(tmp_path / "rebuild_data")
+    shutil.copytree(data_dir, rebuild_data)
+    rebuild_fpath = str(tmp_path / "rebuild" / "d.parquet")
+    os.makedirs(os.path.dirname(rebuild_fpath))
+    utils.data_pipeline.pipeline(rebuild_data, rebuild_fpath)
+    assert_outputs_equal(read_outputs(output_fpath), read_outputs(rebuild_fpath))
+
+def test_missing_weather_is_filled_in_later(tmp_path, fake_weather, monkeypatch):
+    data_dir, output_fpath = str(tmp_path / "data"), str(tmp_path / "out" / "d.parquet")
+    os.makedirs(os.path.dirname(output_fpath))
+    write_first_day(data_dir)
+
+    # The archive does not have the afternoon yet
+    get_weather_data = utils.data_pipeline.get_weather_data
+    available = pd.Timestamp("2022-09-01 12:00", tz="Europe/Berlin")
+    def get_available_weather(start_date, end_date):
+        df_weather = get_weather_data(start_date, end_date)
+        return df_weather[df_weather["time"] < available].reset_index(drop=True)
+
+    monkeypatch.setattr(utils.data_pipeline, "get_weather_data", get_available_weather)
+    utils.data_pipeline.pipeline(data_dir, output_fpath)
+    df = utils.storage.read_dataset(output_fpath)
+    assert df["outside_tmp"].isna().sum() == len(df[df["date_time"] >= "2022-09-01 12:00"]) > 0
+
+    # Once it has, the next run fills the readings in, although no file changed
+    monkeypatch.setattr(utils.data_pipeline, "get_weather_data", get_weather_data)
+    utils.data_pipeline.pipeline(data_dir, output_fpath)
+    backfilled = read_outputs(output_fpath)
+    assert backfilled["data"]["outside_tmp"].notna().all()
+    assert backfilled["hourly"]["outside_tmp_mean"].notna().all()
+
+    rebuild_fpath = str(tmp_path / "rebuild" / "d.parquet")
+    os.makedirs(os.path.dirname(rebuild_fpath))
+    utils.data_pipeline.pipeline(data_dir, rebuild_fpath)
+    assert_outputs_equal(backfilled, read_outputs(rebuild_fpath))
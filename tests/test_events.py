@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+import utils.events
+import utils.storage
+
+def readings(room:str, start:str, co2:list) -> pd.DataFrame:
+    return utils.storage.apply_schema(pd.DataFrame({
+        "date_time": pd.date_range(start, periods=len(co2), freq="15min"),
+        "room": pd.Categorical([room] * len(co2)),
+        "CO2": np.array(co2, dtype="float32"),
+    }))
+
+def test_detect_splits_episodes_at_gaps_and_rooms():
+    df = pd.concat([
+        readings("002", "2022-09-01 08:00", [600, 900, 1300, 900, 600, 900]),
+        # Two hours without readings end the episode
+        readings("002", "2022-09-01 12:00", [900, 900]),
+        readings("101", "2022-09-01 08:00", [900, 900]),
+    ], ignore_index=True)
+    df["room"] = df["room"].astype("category")
+    df_events = utils.events.detect(df)
+
+    assert df_events[["room", "threshold", "readings"]].values.tolist() == [
+        ["002", 850, 3], ["002", 850, 1], ["002", 850, 2], ["002", 1200, 1], ["101", 850, 2],
+    ]
+    first = df_events.iloc[0]
+    assert first["start"] == pd.Timestamp("2022-09-01 08:15") and first["end"] == pd.Timestamp("2022-09-01 08:45")
+    assert first["duration"] == pd.Timedelta(minutes=30) and first["peak"] == 1300
+
+def test_update_stitches_episodes_across_months(tmp_path):
+    output_fpath = str(tmp_path / "d.parquet")
+    august = pd.concat([
+        readings("002", "2022-08-30 08:00", [900, 900, 600]),
+        # Continues into September
+        readings("002", "2022-08-31 23:00", [900, 1300, 900, 900]),
+        readings("101", "2022-08-31 08:00", [900, 600]),
+    ], ignore_index=True)
+    utils.storage.write_dataset(august, output_fpath)
+    utils.events.rebuild(output_fpath)
+
+    september = readings("002", "2022-09-01 00:00", [900, 900, 1300, 600, 900])
+    utils.storage.write_dataset(september, output_fpath)
+    utils.events.update(output_fpath, [("002", "2022-09")])
+
+    df_events = pd.read_parquet(utils.events.events_fpath(output_fpath))
+    expected = utils.events.detect(utils.storage.read_dataset(output_fpath))
+    pd.testing.assert_frame_equal(df_events, expected)
+
+    stitched = df_events[(df_events["room"] == "002") & (df_events["threshold"] == 850)].iloc[1]
+    assert stitched["start"] == pd.Timestamp("2022-08-31 23:00") and stitched["end"] == pd.Timestamp("2022-09-01 00:30")
+    assert stitched["readings"] == 7 and stitched["peak"] == 1300
+    assert len(df_events[df_events["room"] == "101"]) == 1
+
+def test_update_removes_episodes_of_deleted_partitions(tmp_path):
+    output_fpath = str(tmp_path / "d.parquet")
+    utils.storage.write_dataset(readings("002", "2022-09-01 08:00", [900, 900]), output_fpath)
+    utils.storage.write_dataset(readings("101", "2022-09-01 08:00", [900, 900]), output_fpath)
+    utils.events.rebuild(output_fpath)
+
+    utils.storage.delete_partitions(output_fpath, [("002", "2022-09")])
+    utils.events.update(output_fpath, [("002", "2022-09")])
+    df_events = pd.read_parquet(utils.events.events_fpath(output_fpath))
+    assert df_events["room"].tolist() == ["101"]
@@ -0,0 +1,64 @@
+import pandas as pd
+
+import utils.health
+import utils.storage
+
+def readings(room:str, start:str, end:str) -> pd.DataFrame:
+    times = pd.date_range(start, end, freq="15min")
+    return pd.DataFrame({"date_time": times, "room": [room] * len(times)})
+
+def health_table() -> pd.DataFrame:
+    df = pd.concat([
+        # Continuous readings up to the morning of 2022-09-04
+        readings("001", "2022-09-01 00:00", "2022-09-04 06:00"),
+        # Only 2022-09-01, with two hours without readings
+        readings("002", "2022-09-01 00:00", "2022-09-01 11:45"),
+        readings("002", "2022-09-01 14:00", "2022-09-01 23:45"),
+        # Stops on the morning of 2022-09-02
+        readings("003", "2022-09-01 00:00", "2022-09-02 08:00"),
+        # Silent from noon to noon
+        readings("004", "2022-09-02 00:00", "2022-09-02 12:00"),
+        readings("004", "2022-09-03 12:00", "2022-09-03 23:45"),
+    ], ignore_index=True)
+    return utils.health.compute(utils.storage.apply_schema(df.astype({"room": "category"})))
+
+def test_compute_counts_gaps_within_days():
+    df_health = health_table().set_index(["room", "date"])
+    day = df_health.loc[("002", pd.Timestamp("2022-09-01"))]
+    assert day["readings"] == 96 - 8 and day["gaps"] == 1
+    assert day["first_seen"] == pd.Timestamp("2022-09-01 00:00") and day["last_seen"] == pd.Timestamp("2022-09-01 23:45")
+    assert df_health.loc[("001", pd.Timestamp("2022-09-04")), "readings"] == 25
+
+def test_device_status_of_one_day():
+    df_status = utils.health.device_status(health_table(), pd.Timestamp("2022-09-04"))
+
+    assert df_status.index.tolist() == ["002", "003", "004", "001"]
+    assert df_status["status"].tolist() == ["Critical", "Warning", "Good", "Good"]
+    # The reading at midnight is seen
+    assert df_status.loc["001", "since"] == pd.Timedelta(0)
+    assert df_status.loc["004", "since"] == pd.Timedelta(minutes=15)
+    assert df_status.loc["003", "since"] == pd.Timedelta(hours=40)
+    # Only 2022-09-03 is in the window
+    assert df_status["readings"].to_dict() == {"002": 0, "003": 0, "004": 48, "001": 96}
+    assert df_status.loc["001", "uplinks_per_hour"] == 4
+    assert df_status["gaps"].sum() == 0
+
+def test_device_status_of_several_days():
+    df_status = utils.health.device_status(health_table(), pd.Timestamp("2022-09-04"), pd.Timedelta(days=3))
+
+    assert df_status["readings"].to_dict() == {"002": 88, "003": 96 + 33, "004": 49 + 48, "001": 288}
+    # The silence of 004 spans midnight and is counted between the two days
+    assert df_status["gaps"].to_dict() == {"002": 1, "003": 0, "004": 1, "001": 0}
+    assert df_status.loc["001", "uplinks_per_hour"] == 4
+
+def test_device_status_within_a_day():
+    df_status = utils.health.device_status(health_table(), pd.Timestamp("2022-09-04 03:00"))
+
+    # Readings of the current day after the point in time are not seen, the first one is
+    assert df_status.loc["001", "last_seen"] == pd.Timestamp("2022-09-04 00:00")
+    assert df_status.loc["001", "since"] == pd.Timedelta(hours=3)
+    assert df_status.loc["002", "since"] == pd.Timedelta(days=2, hours=3, minutes=15)
+
+    # Before the first reading a device is not listed
+    df_status = utils.health.device_status(health_table(), pd.Timestamp("2022-09-01 23:00"))
+    assert "004" not in df_status.index
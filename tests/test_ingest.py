@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import utils.data_pipeline
+import utils.ingest
+import utils.manifest
+import utils.storage
+from conftest import assert_outputs_equal, dat_line, day_lines, read_outputs, write_dat
+
+def test_read_new_lines_leaves_partial_lines(tmp_path):
+    fpath = str(tmp_path / "a.dat")
+    with open(fpath, "wb") as f:
+        f.write(b"a1\nb2\nc3")
+
+    assert utils.ingest.read_new_lines(fpath, 0) == (b"a1\nb2\n", 6)
+    assert utils.ingest.read_new_lines(fpath, 6) == (b"", 6)
+
+    with open(fpath, "ab") as f:
+        f.write(b"3\nd4\n")
+    assert utils.ingest.read_new_lines(fpath, 6) == (b"c33\nd4\n", 13)
+
+    # An offset within a line skips the rest of that line
+    assert utils.ingest.read_new_lines(fpath, 1) == (b"b2\nc33\nd4\n", 13)
+    assert utils.ingest.read_new_lines(fpath, 7) == (b"d4\n", 13)
+    assert utils.ingest.read_new_lines(fpath, 12) == (b"", 13)
+
+def test_ingest_matches_pipeline(tmp_path, fake_weather):
+    data_dir, output_fpath = str(tmp_path / "data"), str(tmp_path / "out" / "d.parquet")
+    os.makedirs(os.path.dirname(output_fpath))
+    lines = day_lines("002", "2022-09-01", co2=[600] * 40 + [900] * 8 + [1300] * 4 + [600] * 44)
+    fpath = write_dat(data_dir, "002", "2022-09-01", lines[:50])
+    utils.data_pipeline.pipeline(data_dir, output_fpath)
+    manifest = utils.manifest.read_manifest(os.path.join(tmp_path, "out", "manifest.parquet"))
+    state = utils.ingest.initial_state(manifest)
+
+    # The rest of the day in two micro-batches, the second with a late reading of the morning
+    df_weather = utils.data_pipeline.get_weather_data("2022-08-31", "2022-09-01")
+    with open(fpath, "a") as f:
+        f.write("".join(lines[50:70]))
+    assert utils.ingest.ingest_batch(utils.ingest.poll(os.path.dirname(fpath), state), output_fpath, df_weather) == 20
+    with open(fpath, "a") as f:
+        f.write("".join(lines[70:]) + dat_line("2022-09-01 05:07:00", "002", 500))
+    assert utils.ingest.ingest_batch(utils.ingest.poll(os.path.dirname(fpath), state), output_fpath, df_weather) == 27
+
+    partition_dir = utils.storage.partition_dir(output_fpath, "002", "2022-09")
+    assert len(os.listdir(partition_dir)) == 3
+    times = utils.storage.read_dataset(output_fpath)["date_time"]
+    assert len(times) == 97 and times.is_monotonic_increasing
+
+    # The derived tables follow with update_derived, which also merges the appended files
+    assert utils.ingest.update_derived(output_fpath) == 1
+    assert utils.ingest.update_derived(output_fpath) == 0
+    assert os.listdir(partition_dir) == ["part-0.parquet"]
+    ingested = read_outputs(output_fpath)
+
+    rebuild_fpath = str(tmp_path / "rebuild" / "d.parquet")
+    os.makedirs(os.path.dirname(rebuild_fpath))
+    utils.data_pipeline.pipeline(data_dir, rebuild_fpath)
+    rebuild = read_outputs(rebuild_fpath)
+    # The quality table is only written by the pipeline
+    del ingested["quality"], rebuild["quality"]
+    assert_outputs_equal(ingested, rebuild)
+    assert np.array_equal(utils.storage.read_dataset(output_fpath)["date_time"], rebuild["data"]["date_time"])
+
+def test_weather_missing_in_micro_batches_is_filled_in(tmp_path, fake_weather):
+    data_dir, output_fpath = str(tmp_path / "data"), str(tmp_path / "out" / "d.parquet")
+    os.makedirs(os.path.dirname(output_fpath))
+    lines = day_lines("002", "2022-09-01", co2=[600] * 96)
+    fpath = write_dat(data_dir, "002", "2022-09-01", lines[:40])
+    utils.data_pipeline.pipeline(data_dir, output_fpath)
+    state = utils.ingest.initial_state(utils.manifest.read_manifest(os.path.join(tmp_path, "out", "manifest.parquet")))
+
+    # The weather fetched in the morning does not have the afternoon yet
+    df_weather = utils.data_pipeline.get_weather_data("2022-08-31", "2022-09-01")
+    df_weather = df_weather[df_weather["time"] < pd.Timestamp("2022-09-01 12:00", tz="Europe/Berlin")].reset_index(drop=True)
+    with open(fpath, "a") as f:
+        f.write("".join(lines[40:]))
+    tables = utils.ingest.poll(os.path.dirname(fpath), state)
+    assert utils.ingest.weather_missing(df_weather, tables)
+    assert not utils.ingest.weather_missing(df_weather, [table.slice(0, 1) for table in tables])
+    assert utils.ingest.ingest_batch(tables, output_fpath, df_weather) == 56
+    assert utils.storage.read_dataset(output_fpath)["outside_tmp"].isna().sum() == 48
+
+    # update_derived fills in the weather the archive has by now before the rollups are updated
+    assert utils.ingest.update_derived(output_fpath) == 1
+    ingested = read_outputs(output_fpath)
+    assert ingested["data"]["outside_tmp"].notna().all()
+    assert ingested["hourly"]["outside_tmp_mean"].notna().all()
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import time
+
+import pandas as pd
+import pytest
+
+import utils.data_pipeline
+import utils.storage
+import utils.uplink_receiver
+
+UPLINK = json.dumps({"date_time": "2022-09-01 12:00:00", "device_id": "hka-aqm-n002", "CO2": 600, "f_cnt": 1}).encode()
+
+def post(body:bytes=UPLINK, headers:str=None) -> bytes:
+    if headers is None:
+        headers = f"Content-Length: {len(body)}\r\n"
+    return b"POST /uplink HTTP/1.1\r\nHost: localhost\r\n" + headers.encode() + b"\r\n" + body
+
+def exchange(requests:bytes, receiver=None) -> list:
+    """ Send raw requests over one connection and return the status codes of the answers until it is closed. """
+    receiver = receiver or utils.uplink_receiver.UplinkReceiver("unused", max_body_size=1000)
+
+    async def run():
+        server = await asyncio.start_server(receiver.handle, "127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+        writer.write(requests)
+        await writer.drain()
+        statuses = []
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=1)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                break
+            statuses.append(int(head.split(b" ")[1]))
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return statuses
+
+    return asyncio.run(run())
+
+def test_keep_alive_requests_are_served():
+    receiver = utils.uplink_receiver.UplinkReceiver("unused")
+    requests = post() + post(b"[" + UPLINK + b"," + UPLINK + b"]") + b"GET /uplink HTTP/1.1\r\n\r\n" + post(b"{")
+    assert exchange(requests, receiver) == [202, 202, 405, 400]
+    assert len(receiver.buffer) == 3
+
+def test_missing_or_invalid_content_length_is_rejected():
+    # Without a Content-Length the body is empty, so it is not valid JSON
+    assert exchange(post(headers="")) == [400]
+    # The connection is closed, the following request is not answered
+    assert exchange(post(headers="Content-Length: abc\r\n") + post()) == [400]
+    assert exchange(post(headers="Content-Length: -5\r\n") + post()) == [400]
+    assert exchange(post(headers=f"Content-Length: {len(UPLINK)}\r\nContent-Length: 3\r\n") + post()) == [400]
+    assert exchange(b"POST\r\n\r\n" + post()) == [400]
+
+def test_large_bodies_and_transfer_encodings_are_rejected():
+    assert exchange(post(b"[" + b",".join([UPLINK] * 20) + b"]") + post()) == [413]
+    assert exchange(post(b"5\r\n[1,2]\r\n0\r\n\r\n", headers="Transfer-Encoding: chunked\r\n") + post()) == [411]
+    assert exchange(post(headers="Transfer-Encoding: gzip, chunked\r\n") + post()) == [501]
+    assert exchange(post(headers="X-Padding: " + "x" * 70000 + "\r\n")) == [431]
+
+def uplink(f_cnt:int, device_id:str="hka-aqm-n002", received_at:str="2022-09-01T10:00:00Z") -> dict:
+    return {
+        "end_device_ids": {"device_id": device_id},
+        "received_at": received_at,
+        "uplink_message": {"f_cnt": f_cnt, "decoded_payload": {"tmp": 22.5, "hum": 50.0, "CO2": 600, "VOC": 100}},
+    }
+
+def test_uplinks_are_converted_to_local_time():
+    uplinks = [
+        # TTS timestamps are UTC, 2022-09-01 is in summer time (UTC+2)
+        uplink(1),
+        uplink(2, received_at="2022-09-01T10:00:00"),
+        # Flat uplinks are in local time unless they have an offset
+        {"date_time": "2022-09-01 12:00:00", "device_id": "hka-aqm-n101", "CO2": 600, "f_cnt": 3},
+        {"date_time": "2022-09-01T12:00:00+01:00", "device_id": "hka-aqm-n101", "CO2": 600, "f_cnt": 4},
+    ]
+    table = utils.uplink_receiver.records_to_table([utils.uplink_receiver.parse_uplink(u) for u in uplinks])
+    assert table["date_time"].to_pylist() == [pd.Timestamp(t) for t in ["2022-09-01 12:00", "2022-09-01 12:00", "2022-09-01 12:00", "2022-09-01 13:00"]]
+    assert table["device_id"].to_pylist() == ["hka-aqm-n002"] * 2 + ["hka-aqm-n101"] * 2
+
+@pytest.mark.parametrize("bad", [
+    uplink(1, received_at="yesterday"),
+    uplink(1, received_at=""),
+    uplink(1, device_id="eui-70b3d57ed005a1b2"),
+    uplink(-1),
+    {"date_time": "2022-09-01 12:00:00", "device_id": "hka-aqm-n002"},
+])
+def test_parse_uplink_rejects_invalid_values(bad):
+    with pytest.raises((KeyError, TypeError, ValueError)):
+        utils.uplink_receiver.parse_uplink(bad)
+
+def test_bad_uplinks_are_rejected_and_good_ones_stored(tmp_path, fake_weather):
+    output_fpath = str(tmp_path / "d.parquet")
+    receiver = utils.uplink_receiver.UplinkReceiver(output_fpath)
+    receiver.df_weather, receiver.weather_time = utils.data_pipeline.get_weather_data("2022-08-31", "2022-09-01"), time.time()
+
+    requests = [
+        [uplink(1)],
+        [uplink(2), uplink(3, received_at="2022-13-01T10:00:00Z")],
+        [uplink(4, device_id="eui-70b3d57ed005a1b2")],
+        [uplink(5), uplink(6)],
+    ]
+    body = b"".join(post(json.dumps(r).encode()) for r in requests)
+    assert exchange(body, receiver) == [202, 400, 400, 202]
+
+    receiver.write(receiver.buffer)
+    assert utils.storage.read_dataset(output_fpath)["f_cnt"].tolist() == [1, 5, 6]
+
+def test_write_drops_only_failing_records(tmp_path, fake_weather):
+    output_fpath = str(tmp_path / "d.parquet")
+    receiver = utils.uplink_receiver.UplinkReceiver(output_fpath)
+    receiver.df_weather, receiver.weather_time = utils.data_pipeline.get_weather_data("2022-08-31", "2022-09-01"), time.time()
+
+    records = [utils.uplink_receiver.parse_uplink(uplink(f_cnt, received_at=f"2022-09-01T10:{f_cnt:02d}:00Z")) for f_cnt in range(10)]
+    # A record that got past the validation, its room has no floor
+    records.insert(4, (pd.Timestamp("2022-09-01 12:30").value, False, "eui-70b3d57ed005a1b2", 22.5, 50.0, 600.0, 100.0, 99))
+    receiver.write(records)
+    assert utils.storage.read_dataset(output_fpath)["f_cnt"].tolist() == list(range(10))
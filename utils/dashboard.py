@@ -1,31 +1,138 @@
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import datetime
 
-def get_main_fig(df_room, search_start, search_end, sensor_selected):
-    """ Create a plotly figure with the given data and parameters """
-
-    #----- Filter Data to only show the selected time range -----------------------------------------------------
-    df_data = df_room[(df_room["date_time"] >= search_start) & (df_room["date_time"] <= search_end)]
-    df_data = df_data.sort_values("date_time", ascending=True)
-    df_data = df_data.set_index("date_time")
-
-    df_data = df_data[[sensor_selected]]
-
-    #----- Resample Data to show the correct time range ---------------------------------------------------------
+def downsample_minmax(times, values, max_points):
+    """
+    Reduce a time series to at most max_points points by splitting the time range into
+    max_points / 2 equally long buckets and keeping the minimum and maximum of every bucket.
+    Peaks survive, which a mean per bucket would flatten.
+
+    Args:
+        times (np.ndarray): The times, sorted ascending.
+        values (np.ndarray): The values, without NaN.
+        max_points (int): The maximum number of returned points.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The times and values of the kept points.
+    """
+    if len(times) <= max_points:
+        return times, values
+
+    n_buckets = max_points // 2
+    offsets = (times - times[0]).astype(np.int64).astype(np.float64)
+    buckets = np.minimum((offsets / (offsets[-1] + 1) * n_buckets).astype(np.int64), n_buckets - 1)
+    starts = np.flatnonzero(np.diff(buckets, prepend=-1))
+
+    # Index of the minimum and maximum within every bucket
+    order = np.lexsort((values, buckets))
+    ends = np.append(starts[1:], len(values))
+    lows, highs = order[starts], order[ends - 1]
+
+    keep = np.unique(np.concatenate([lows, highs]))
+    return times[keep], values[keep]
+
+def downsample_lttb(times, values, max_points):
+    """
+    Reduce a time series to at most max_points points with Largest-Triangle-Three-Buckets: from every
+    bucket the point is kept that spans the largest triangle with the previously kept point and the
+    mean of the next bucket. The first and last point are always kept.
+
+    Args:
+        times (np.ndarray): The times, sorted ascending.
+        values (np.ndarray): The values, without NaN.
+        max_points (int): The maximum number of returned points (at least 3).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The times and values of the kept points.
+    """
+    n = len(times)
+    if n <= max_points:
+        return times, values
+
+    x = (times - times[0]).astype(np.int64).astype(np.float64)
+    y = np.asarray(values, dtype=np.float64)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+
+    keep = np.empty(max_points, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    for i in range(max_points - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = x[stop:next_stop].mean(), y[stop:next_stop].mean()
+
+        a = keep[i]
+        areas = np.abs((x[a] - next_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (next_y - y[a]))
+        keep[i + 1] = start + np.argmax(areas)
+
+    return times[keep], values[keep]
+
+DOWNSAMPLING = {"minmax": downsample_minmax, "lttb": downsample_lttb}
+
+def downsampled_series(df_room, search_start, search_end, sensor_selected, downsample, max_points):
+    """
+    Returns at most max_points readings of a sensor for the time range as a DataFrame indexed by time.
+    Where no readings exist for more than an hour (or the time covered by one point) a NaN is
+    inserted, so the line is interrupted like for the resampled data. These gap markers count
+    against max_points, there are at most max_points / 2 of them.
+    """
+    times = df_room["date_time"].to_numpy()
+    first = times.searchsorted(np.datetime64(search_start), side="left")
+    last = times.searchsorted(np.datetime64(search_end), side="right")
+    times = times[first:last]
+    values = df_room[sensor_selected].to_numpy(dtype=np.float64)[first:last]
+    valid = ~np.isnan(values)
+    times, values = times[valid], values[valid]
+
+    if len(times) == 0:
+        return pd.DataFrame({sensor_selected: pd.Series([np.nan, np.nan], index=[search_start, search_end])})
+
+    max_gap = max(np.timedelta64(1, "h"), (times[-1] - times[0]) // max(max_points // 2, 1))
+    gaps = times[:-1][np.diff(times) > max_gap] + np.timedelta64(1, "s")
+
+    times, values = DOWNSAMPLING[downsample](times, values, max_points - len(gaps))
+    times = np.concatenate([times, gaps])
+    values = np.concatenate([values, np.full(len(gaps), np.nan)])
+    order = np.argsort(times, kind="stable")
+    return pd.DataFrame({sensor_selected: values[order]}, index=pd.DatetimeIndex(times[order], name="date_time"))
+
+def get_main_fig(df_room, search_start, search_end, sensor_selected, downsample=None, max_points=1000):
+    """
+    Create a plotly figure with the given data and parameters
+
+    df_room has to be sorted ascending by date_time. Without downsample the readings are averaged
+    per hour (up to 6 days) or per day.
+
+    With downsample ("minmax" or "lttb") the readings are not averaged per hour or day, but at most
+    max_points of them are shown, chosen so that peaks are kept.
+    """
     time_diff = search_end - search_start
 
-    if time_diff <= datetime.timedelta(days=1):
-        date_range = pd.date_range(start=search_start.strftime("%Y-%m-%d %H"), end=search_end.strftime("%Y-%m-%d %H"), freq="H")
-        df_data = df_data.resample("H").mean().reindex(date_range)
-
-    elif time_diff > datetime.timedelta(days=1) and time_diff <= datetime.timedelta(days=6):
-        date_range = pd.date_range(start=search_start.strftime("%Y-%m-%d %H"), end=search_end.strftime("%Y-%m-%d %H"), freq="H")
-        df_data = df_data.resample("H").mean().reindex(date_range)
-
-    elif time_diff > datetime.timedelta(days=6):
-        date_range = pd.date_range(start=search_start.date(), end=search_end.date(), freq="D")
-        df_data = df_data.resample("D").mean().reindex(date_range)
+    if downsample is not None:
+        df_data = downsampled_series(df_room, search_start, search_end, sensor_selected, downsample, max_points)
+    else:
+        #----- Filter Data to only show the selected time range -----------------------------------------------------
+        times = df_room["date_time"].to_numpy()
+        first = times.searchsorted(np.datetime64(search_start), side="left")
+        last = times.searchsorted(np.datetime64(search_end), side="right")
+        df_data = df_room.iloc[first:max(first, last)]
+        df_data = df_data.set_index("date_time")
+
+        df_data = df_data[[sensor_selected]]
+
+        #----- Resample Data to show the correct time range ---------------------------------------------------------
+        if time_diff <= datetime.timedelta(days=1):
+            date_range = pd.date_range(start=search_start.strftime("%Y-%m-%d %H"), end=search_end.strftime("%Y-%m-%d %H"), freq="H")
+            df_data = df_data.resample("H").mean().reindex(date_range)
+
+        elif time_diff > datetime.timedelta(days=1) and time_diff <= datetime.timedelta(days=6):
+            date_range = pd.date_range(start=search_start.strftime("%Y-%m-%d %H"), end=search_end.strftime("%Y-%m-%d %H"), freq="H")
+            df_data = df_data.resample("H").mean().reindex(date_range)
+
+        elif time_diff > datetime.timedelta(days=6):
+            date_range = pd.date_range(start=search_start.date(), end=search_end.date(), freq="D")
+            df_data = df_data.resample("D").mean().reindex(date_range)
         
     df_data[sensor_selected] = df_data[sensor_selected].round(2)
 
@@ -128,15 +235,99 @@ def get_main_fig(df_room, search_start, search_end, sensor_selected):
 
 
 
-def get_tacho(df, room, sensor, main_color="blue", light_color="lightgrey"):
-    """ Create a plotly figure with a gauge to show the quantile of a value of a sensor compared to the other rooms"""
-    
-    room_avg = df.groupby('room')[sensor].mean().reset_index()
-    room_avg = room_avg.rename(columns={sensor: f'avg_{sensor}'})
-    avg_to_compare = room_avg[room_avg['room'] == room][f'avg_{sensor}'].values[0]
-    room_avg['quantile'] = pd.qcut(room_avg[f'avg_{sensor}'], q=100, labels=False, duplicates='drop')
+def window_stats(df_room, end, sensors, window=pd.Timedelta(days=1)):
+    """
+    Statistics of the sensors for the window before end and the window before that.
 
-    quantile_of_room = room_avg[room_avg['room'] == room]['quantile'].values[0]
+    The window boundaries are found by binary search in date_time, so only the rows of the two
+    windows are touched, no matter how much history the room has.
+
+    Args:
+        df_room (pd.DataFrame): The data of one room, sorted ascending by date_time.
+        end (pd.Timestamp): The end of the current window.
+        sensors (list): The sensor columns.
+        window (pd.Timedelta): The length of a window.
+
+    Returns:
+        pd.DataFrame: The rows max, min and mean (current window, end - window <= date_time <= end)
+        and mean_before (previous window, end - 2 * window <= date_time <= end - window) per sensor,
+        rounded to two decimals.
+    """
+    times = df_room["date_time"].to_numpy()
+    end = np.datetime64(pd.Timestamp(end))
+    window = np.timedelta64(pd.Timedelta(window))
+
+    start, before_start = times.searchsorted([end - window, end - 2 * window], side="left")
+    stop, before_stop = times.searchsorted([end, end - window], side="right")
+
+    current = df_room[sensors].iloc[start:stop]
+    before = df_room[sensors].iloc[before_start:before_stop]
+    stats = pd.DataFrame(
+        [current.max(), current.min(), current.mean(), before.mean()],
+        index=["max", "min", "mean", "mean_before"],
+        dtype="float64"
+    )
+    return stats.round(2)
+
+def get_density(df, x, y, bins=60):
+    """
+    Count the readings in a grid of bins x bins over the value ranges of two columns, e.g. to draw a
+    heatmap instead of a scatterplot with every reading.
+
+    Returns:
+        pd.DataFrame: The columns x_start, x_end, y_start, y_end and count of every non-empty bin.
+    """
+    values = df[[x, y]].to_numpy(dtype=np.float64)
+    values = values[~np.isnan(values).any(axis=1)]
+    if len(values) == 0:
+        return pd.DataFrame(columns=["x_start", "x_end", "y_start", "y_end", "count"])
+
+    counts, x_edges, y_edges = np.histogram2d(values[:, 0], values[:, 1], bins=bins)
+    x_bins, y_bins = np.nonzero(counts)
+    return pd.DataFrame({
+        "x_start": x_edges[x_bins],
+        "x_end": x_edges[x_bins + 1],
+        "y_start": y_edges[y_bins],
+        "y_end": y_edges[y_bins + 1],
+        "count": counts[x_bins, y_bins].astype(np.int64),
+    })
+
+def stratified_sample(df, by, n, seed=0):
+    """ Sample about n rows of df with the same number of rows (or all of them) from every group of the column by. """
+    groups = df[by]
+    k = max(int(np.ceil(n / max(groups.nunique(), 1))), 1)
+    random_rank = pd.Series(np.random.default_rng(seed).random(len(df)), index=df.index).groupby(groups, observed=True).rank()
+    return df[random_rank <= k]
+
+def get_room_stats(room_avg):
+    """
+    Percentile ranks of the room averages, as shown by get_tacho.
+
+    Args:
+        room_avg (pd.DataFrame): The average of every sensor (columns) per room (index).
+
+    Returns:
+        pd.DataFrame: The columns avg_<sensor> and quantile_<sensor> (0 to 99) per room.
+    """
+    room_stats = {}
+    for sensor in room_avg.columns:
+        room_stats[f'avg_{sensor}'] = room_avg[sensor]
+        room_stats[f'quantile_{sensor}'] = pd.qcut(room_avg[sensor], q=100, labels=False, duplicates='drop')
+    return pd.DataFrame(room_stats, index=room_avg.index)
+
+def get_tacho(df, room, sensor, main_color="blue", light_color="lightgrey", room_stats=None):
+    """
+    Create a plotly figure with a gauge to show the quantile of a value of a sensor compared to the other rooms
+
+    room_stats are the precomputed averages and percentile ranks of all rooms (see get_room_stats),
+    otherwise they are computed from df.
+    """
+    if room_stats is None:
+        room_stats = get_room_stats(df.groupby('room', observed=True)[[sensor]].mean())
+
+    room_avg = room_stats[f'avg_{sensor}']
+    avg_to_compare = room_avg.loc[room]
+    quantile_of_room = room_stats[f'quantile_{sensor}'].loc[room]
     percentile_of_room = (quantile_of_room + 1)
 
     fig = go.Figure(go.Indicator(
@@ -144,14 +335,14 @@ def get_tacho(df, room, sensor, main_color="blue", light_color="lightgrey"):
         value=avg_to_compare,
         number={'font': {'size': 40}},
         gauge={
-            'axis': {'range': [room_avg[f'avg_{sensor}'].min(), room_avg[f'avg_{sensor}'].max()],
+            'axis': {'range': [room_avg.min(), room_avg.max()],
                     'tickfont': {'size': 20, 'color': "black"}},
             'bar': {'color': main_color, 'thickness': 0.4},
             'bgcolor': "white",
             'borderwidth': 2,
             'bordercolor': "white",
             'steps': [
-                {'range': [room_avg[f'avg_{sensor}'].min(), room_avg[f'avg_{sensor}'].max()], 'color': light_color, 'thickness': 0.4},
+                {'range': [room_avg.min(), room_avg.max()], 'color': light_color, 'thickness': 0.4},
             ],
             'threshold': {
                 'line': {'color': main_color, 'width': 1},
@@ -0,0 +1,266 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+import utils.dashboard
+import utils.events
+import utils.health
+import utils.rollups
+import utils.storage
+
+# Process-wide cache for the data read by the dashboard. Streamlit reruns the page scripts on
+# every interaction and for every session, but all sessions share this module, so every frame
+# is read once per data version and then shared.
+#
+# The returned frames are shared between all sessions and must not be modified in place
+# (no column assignment, no inplace=True). Filtering, sorting etc. create new frames and are fine.
+
+DATASET_DIR = "data/processed/data_building_n.parquet"
+ROOM_INFORMATION_FPATH = "data/processed/room_information.parquet"
+
+# Maximum total memory of the cached frames in bytes (DataFrame.memory_usage(deep=True)), the least
+# recently used frames are dropped first. The most recent frame is always kept, even if it is larger.
+MAX_BYTES = 1024 ** 3
+
+_cache = OrderedDict()
+_cache_bytes = 0
+_lock = threading.Lock()
+
+def data_version(path:str) -> tuple:
+    """
+    Returns a token that changes whenever the data at path (a file or a dataset directory) changes.
+
+    Files are rewritten as a whole, so their mtime and size are used. Datasets are written with
+    utils.storage, which replaces their version file after every change. Only for datasets without
+    a version file (written by earlier versions) all files are listed.
+    """
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    try:
+        stat = os.stat(utils.storage.version_fpath(path))
+        return (stat.st_ino, stat.st_mtime_ns)
+    except FileNotFoundError:
+        pass
+
+    n_files, mtime, size = 0, 0, 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            stat = os.stat(os.path.join(dir_path, file_name))
+            n_files += 1
+            mtime = max(mtime, stat.st_mtime_ns)
+            size += stat.st_size
+    return (n_files, mtime, size)
+
+def memory_usage(value) -> int:
+    """ Returns the memory used by a cached value (a frame, a RoomIndex or a tuple of frames) in bytes. """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, RoomIndex):
+        return memory_usage(value.df) + value.times.nbytes
+    if isinstance(value, tuple):
+        return sum(memory_usage(v) for v in value)
+    return 0
+
+def cached(key:Hashable, path:Union[str, List[str]], load:Callable[[], pd.DataFrame]) -> pd.DataFrame:
+    """
+    Returns the cached result of load() for key, load() is called again if the data at path changed.
+
+    Args:
+        key (Hashable): Identifies the request, e.g. the function name and its arguments.
+        path (str or List[str]): The files or directories the result is derived from.
+        load (Callable): Reads the data.
+    """
+    global _cache_bytes
+    version = tuple(data_version(p) for p in path) if isinstance(path, list) else data_version(path)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == version:
+            _cache.move_to_end(key)
+            return entry[1]
+
+    value = load()
+    size = memory_usage(value)
+
+    with _lock:
+        if key in _cache:
+            _cache_bytes -= _cache.pop(key)[2]
+        _cache[key] = (version, value, size)
+        _cache_bytes += size
+        while _cache_bytes > MAX_BYTES and len(_cache) > 1:
+            _cache_bytes -= _cache.popitem(last=False)[1][2]
+    return value
+
+def clear() -> None:
+    """ Drop all cached frames. """
+    global _cache_bytes
+    with _lock:
+        _cache.clear()
+        _cache_bytes = 0
+
+def _key(*args) -> tuple:
+    return tuple(tuple(arg) if isinstance(arg, list) else arg for arg in args)
+
+def _parse_dates(df:pd.DataFrame, parse_dates:bool) -> pd.DataFrame:
+    if parse_dates and "date" in df.columns:
+        df["date"] = pd.to_datetime(df["date"])
+    return df
+
+class RoomIndex:
+    """
+    The processed data sorted by room and date_time with the row range of every room.
+
+    The rows of a room, and of a time range within a room, are contiguous, so they are returned as
+    slices (views) of the sorted frame. The boundaries are found by binary search instead of
+    comparing every row.
+
+    Args:
+        df (pd.DataFrame): Processed data with a categorical room and a date_time column.
+    """
+    def __init__(self, df:pd.DataFrame):
+        self.df = df.sort_values(["room", "date_time"], ignore_index=True, kind="stable")
+        self.times = self.df["date_time"].to_numpy()
+
+        categories = self.df["room"].cat.categories
+        bounds = self.df["room"].cat.codes.to_numpy().searchsorted(np.arange(len(categories) + 1))
+        self.offsets = {
+            room: (start, stop) for room, start, stop in zip(categories, bounds[:-1], bounds[1:]) if stop > start
+        }
+
+    @property
+    def rooms(self) -> List[str]:
+        return sorted(self.offsets)
+
+    def slice(self, room:str, start:pd.Timestamp=None, end:pd.Timestamp=None) -> pd.DataFrame:
+        """ Returns the rows of room with start <= date_time <= end (both optional), sorted by date_time. """
+        offset, stop = self.offsets.get(room, (0, 0))
+        times = self.times[offset:stop]
+        first = 0 if start is None else times.searchsorted(np.datetime64(pd.Timestamp(start)), side="left")
+        last = len(times) if end is None else times.searchsorted(np.datetime64(pd.Timestamp(end)), side="right")
+        return self.df.iloc[offset + first:offset + max(first, last)]
+
+def read_room_index(dataset_dir:str=DATASET_DIR, columns:List[str]=None) -> RoomIndex:
+    """ Cached RoomIndex of the processed data (only the given columns, room and date_time are always read). """
+    if columns is not None:
+        columns = ["room", "date_time"] + [c for c in columns if c not in ("room", "date_time")]
+    return cached(
+        _key("room_index", dataset_dir, columns),
+        dataset_dir,
+        lambda: RoomIndex(utils.storage.read_dataset(dataset_dir, columns=columns))
+    )
+
+def read_dataset(
+        dataset_dir:str=DATASET_DIR,
+        room=None,
+        start:pd.Timestamp=None,
+        end:pd.Timestamp=None,
+        columns:List[str]=None,
+        parse_dates:bool=False
+    ) -> pd.DataFrame:
+    """
+    Cached version of utils.storage.read_dataset.
+
+    Args:
+        parse_dates (bool): Convert the date column to datetime64.
+    """
+    return cached(
+        _key("dataset", dataset_dir, room, start, end, columns, parse_dates),
+        dataset_dir,
+        lambda: _parse_dates(utils.storage.read_dataset(dataset_dir, room=room, start=start, end=end, columns=columns), parse_dates)
+    )
+
+def read_rollup(
+        resolution:str,
+        dataset_dir:str=DATASET_DIR,
+        room=None,
+        start:pd.Timestamp=None,
+        end:pd.Timestamp=None,
+        columns:List[str]=None,
+        parse_dates:bool=False
+    ) -> pd.DataFrame:
+    """
+    Cached version of utils.rollups.read_rollup.
+
+    Args:
+        parse_dates (bool): Convert the date column to datetime64.
+    """
+    return cached(
+        _key("rollup", resolution, dataset_dir, room, start, end, columns, parse_dates),
+        utils.rollups.rollup_dir(dataset_dir, resolution),
+        lambda: _parse_dates(utils.rollups.read_rollup(dataset_dir, resolution, room=room, start=start, end=end, columns=columns), parse_dates)
+    )
+
+def read_room_stats(sensors:List[str], dataset_dir:str=DATASET_DIR) -> pd.DataFrame:
+    """
+    Cached averages and percentile ranks of all rooms for the gauges (see utils.dashboard.get_room_stats).
+    The averages are combined from the daily rollup instead of the readings.
+    """
+    def load():
+        columns = ["room"] + [f"{sensor}_{statistic}" for sensor in sensors for statistic in ("mean", "count")]
+        df_daily = utils.rollups.read_rollup(dataset_dir, "daily", columns=columns)
+        room_avg = utils.rollups.weighted_mean(df_daily, "room", sensors).set_index("room")
+        return utils.dashboard.get_room_stats(room_avg)
+
+    return cached(_key("room_stats", dataset_dir, sensors), utils.rollups.rollup_dir(dataset_dir, "daily"), load)
+
+def read_filtered_means(
+        floors:List[str]=None,
+        rooms:List[str]=None,
+        seasons:List[str]=None,
+        days_of_week:List[int]=None,
+        dataset_dir:str=DATASET_DIR
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Cached means of all rollup columns per hour of the day and per date over the rooms and days
+    that pass the filters (empty or None filters are not applied), as shown on the Floors page.
+
+    All columns are aggregated in one pass per resolution, so every chart of a filter combination
+    is served from the same result.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: The means per hour and the means per date (every day of
+            the range, days without readings are empty).
+    """
+    filters = {"floor": floors, "room": rooms, "season": seasons, "day_of_week": days_of_week}
+
+    def load():
+        results = []
+        for resolution, by in (("hourly", "hour"), ("daily", "date")):
+            df_rollup = read_rollup(resolution, dataset_dir, parse_dates=True)
+            mask = np.ones(len(df_rollup), dtype=bool)
+            for column, values in filters.items():
+                if values:
+                    mask &= df_rollup[column].isin(values).to_numpy()
+            results.append(utils.rollups.weighted_mean(df_rollup[mask], by, utils.rollups.ROLLUP_COLUMNS))
+
+        by_hour, by_date = results
+        by_date = by_date.set_index("date").resample("D").mean().reset_index()
+        return by_hour, by_date
+
+    key = _key("filtered_means", dataset_dir, *(sorted(values) if values else None for values in filters.values()))
+    return cached(key, [utils.rollups.rollup_dir(dataset_dir, resolution) for resolution in ("hourly", "daily")], load)
+
+def read_device_status(at:pd.Timestamp, window:pd.Timedelta=pd.Timedelta(days=1), dataset_dir:str=DATASET_DIR) -> pd.DataFrame:
+    """ Cached status of all devices at a point in time (see utils.health.device_status). """
+    return cached(
+        _key("device_status", dataset_dir, pd.Timestamp(at), window),
+        utils.health.health_fpath(dataset_dir),
+        lambda: utils.health.device_status(utils.health.read_health(dataset_dir), at, window)
+    )
+
+def read_co2_events(dataset_dir:str=DATASET_DIR) -> pd.DataFrame:
+    """ Cached CO2 episodes of all rooms (see utils.events). """
+    return cached(
+        _key("co2_events", dataset_dir),
+        utils.events.events_fpath(dataset_dir),
+        lambda: utils.events.read_events(dataset_dir)
+    )
+
+def read_room_information(fpath:str=ROOM_INFORMATION_FPATH) -> pd.DataFrame:
+    """ Cached room information of the HKA API (see utils.data_pipeline.get_room_info_hka_api). """
+    return cached(_key("room_information", fpath), fpath, lambda: pd.read_parquet(fpath))
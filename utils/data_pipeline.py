@@ -12,23 +12,96 @@ os.chdir(git_root)
 new_dir = os.getcwd()
 sys.path.append(git_root)
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Tuple
 import utils.dirs
+import utils.events
+import utils.health
+import utils.manifest
+import utils.rollups
+import utils.storage
 import tqdm
 from colorama import Fore, Style
 import utils.weather
 
-def load_data(data_dir:str) -> pd.DataFrame:
+# Columns of the hka-log V 1.1 format. Files written by V 1.0 of the logger
+# lack the WIFI and BLE columns, these are filled with nulls when reading.
+DAT_SCHEMA = pa.schema([
+    ("date_time", pa.timestamp("ns")),
+    ("device_id", pa.string()),
+    ("tmp", pa.float64()),
+    ("hum", pa.float64()),
+    ("CO2", pa.int64()),
+    ("VOC", pa.int64()),
+    ("vis", pa.int64()),
+    ("IR", pa.int64()),
+    ("WIFI", pa.int64()),
+    ("BLE", pa.int64()),
+    ("rssi", pa.int64()),
+    ("channel_rssi", pa.int64()),
+    ("snr", pa.float64()),
+    ("gateway", pa.string()),
+    ("channel_index", pa.int64()),
+    ("spreading_factor", pa.int64()),
+    ("bandwidth", pa.int64()),
+    ("f_cnt", pa.int64()),
+])
+
+# Columns that are actually used by the pipeline, the radio metadata is not needed
+RAW_COLUMNS = ["date_time", "device_id", "tmp", "hum", "CO2", "VOC", "f_cnt"]
+
+# Valid ranges (exclusive) of the sensor values, readings outside of them are dropped
+VALIDATION_RULES = {
+    "tmp": (-20, 50),
+    "hum": (0, 100),
+    "CO2": (0, 10000),
+    "VOC": (0, 10000),
+}
+
+# Coordinates of Karlsruhe
+LATITUDE = 49.014920
+LONGITUDE = 8.390050
+
+def read_dat_file(fpath:str, columns:List[str]=None) -> pa.Table:
+    """
+    Read a single hka-log .dat file into an Arrow table with the fixed DAT_SCHEMA.
+
+    The first line of every file is the logger comment, the second line the header.
+
+    Args:
+        fpath (str): The path of the .dat file.
+        columns (List[str]): Only read these columns. Defaults to all columns of DAT_SCHEMA.
+    """
+    return pyarrow.csv.read_csv(
+        fpath,
+        read_options=pyarrow.csv.ReadOptions(skip_rows=1, use_threads=False),
+        parse_options=pyarrow.csv.ParseOptions(delimiter=";"),
+        convert_options=pyarrow.csv.ConvertOptions(
+            column_types=DAT_SCHEMA,
+            include_columns=columns or DAT_SCHEMA.names,
+            include_missing_columns=True
+        )
+    )
+
+def load_data(data_dir:str, parallel:bool=False, max_workers:int=None) -> pd.DataFrame:
     """
     Load data from files in the specified directory with the given file extension.
 
     Parameters:
     - data_dir (str): The directory path where the data files are located.
+    - parallel (bool): Parse the files with Arrow on a thread pool instead of one by one with pandas.
+    - max_workers (int): Number of threads used in parallel mode. Defaults to the number of cores.
     """
     
     print(Style.BRIGHT + Fore.LIGHTMAGENTA_EX + "Loading Data")
     print(Style.RESET_ALL)
+
+    if parallel:
+        return load_data_parallel(data_dir, max_workers=max_workers)
     
     df_list = []
     errors = []
@@ -50,14 +123,123 @@ def load_data(data_dir:str) -> pd.DataFrame:
     print("\n")
 
     return pd.concat(df_list, ignore_index=True) if df_list else pd.DataFrame()
+
+def load_data_parallel(data_dir:str, max_workers:int=None) -> pd.DataFrame:
+    """
+    Load all .dat files of a directory in parallel.
+
+    Args:
+        data_dir (str): The directory path where the data files are located.
+        max_workers (int): Number of threads. Defaults to the number of cores.
+    """
+    fpaths = [os.path.join(data_dir, file_name) for file_name in sorted(os.listdir(data_dir)) if file_name.endswith(".dat")]
+    df, _ = load_files(fpaths, max_workers=max_workers)
+    return df
+
+def load_files(fpaths:List[str], max_workers:int=None, columns:List[str]=None) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Load the given .dat files in parallel.
+
+    Every file is parsed into an Arrow table with the fixed DAT_SCHEMA. Arrow releases the GIL
+    while parsing, so a thread pool scales with the number of cores. The tables are concatenated
+    without copying and converted to pandas once at the end.
+
+    Args:
+        fpaths (List[str]): The paths of the .dat files.
+        max_workers (int): Number of threads. Defaults to the number of cores.
+        columns (List[str]): Only read these columns. Defaults to all columns of DAT_SCHEMA.
+
+    Returns:
+        Tuple[pd.DataFrame, Dict[str, int]]: The loaded data and the number of rows of every file
+        that could be loaded.
+    """
+    def read(fpath):
+        try:
+            return read_dat_file(fpath, columns=columns), None
+        except Exception as e:
+            return None, f"Error loading file {os.path.basename(fpath)}: {e}"
+
+    tables = []
+    rows = {}
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        for fpath, (table, error) in zip(fpaths, tqdm.tqdm(executor.map(read, fpaths), total=len(fpaths))):
+            if error is None:
+                tables.append(table)
+                rows[fpath] = table.num_rows
+            else:
+                errors.append(error)
+
+    for e in errors:
+        print('\n')
+        print(Fore.RED + e)
+        print(Style.RESET_ALL)
+
+    print("✓ Done")
+    print("\n")
+
+    if not tables:
+        return pd.DataFrame(), rows
+
+    return pa.concat_tables(tables).to_pandas(), rows
     
 
-def preprocess_data(df:pd.DataFrame) -> pd.DataFrame:
+def validate(df:pd.DataFrame) -> Tuple[np.ndarray, pd.DataFrame]:
+    """
+    Evaluate all VALIDATION_RULES in one pass.
+
+    Args:
+        df (pd.DataFrame): The raw readings.
+
+    Returns:
+        Tuple[np.ndarray, pd.DataFrame]: The mask of the valid rows and a table with one boolean
+        column per rule violation (<column>_missing, <column>_out_of_range).
+    """
+    valid = np.ones(len(df), dtype=bool)
+    violations = {}
+    for column, (low, high) in VALIDATION_RULES.items():
+        values = df[column].to_numpy(dtype=float)
+        missing = np.isnan(values)
+        out_of_range = ~missing & ~((values > low) & (values < high))
+        violations[f"{column}_missing"] = missing
+        violations[f"{column}_out_of_range"] = out_of_range
+        valid &= ~(missing | out_of_range)
+
+    return valid, pd.DataFrame(violations, index=df.index)
+
+def duplicated_readings(df:pd.DataFrame, device_column:str="device_id") -> np.ndarray:
+    """
+    Mark repeated uplinks, e.g. the same uplink logged by two gateways.
+
+    An uplink is identified by its device, frame counter and time. The frame counter alone is not
+    unique, it wraps around and starts again at 0 when a device is reset, so the time is part of the key.
+
+    Args:
+        df (pd.DataFrame): The readings.
+        device_column (str): The column identifying the device (device_id for raw, room for processed data).
+
+    Returns:
+        np.ndarray: True for every reading that already occurred before in df.
+    """
+    if "f_cnt" not in df.columns:
+        return df.duplicated().to_numpy()
+
+    device_codes, _ = pd.factorize(df[device_column])
+    # Device and 32 bit frame counter packed into one integer
+    uplink = (device_codes.astype(np.int64) << 32) | (df["f_cnt"].to_numpy(dtype=np.int64) & 0xFFFFFFFF)
+    time = df["date_time"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+    return pd.DataFrame({"uplink": uplink, "time": time}).duplicated().to_numpy()
+
+def preprocess_data(df:pd.DataFrame, return_rejections:bool=False, dates:pd.Series=None) -> pd.DataFrame:
     """
     Preprocesses a pandas DataFrame.
     
     Args:
         df pd.DataFrame: A pandas DataFrame to be preprocessed.
+        return_rejections (bool): Also return the data quality table with the number of readings
+            per device and day, and how many of them were rejected by each rule.
+        dates (pd.Series): The day every reading is counted for in the data quality table, e.g. the
+            date of its file. Defaults to the day of the reading.
     """
     print(Style.BRIGHT +  Fore.LIGHTMAGENTA_EX + "Preprocessing Data")
     print(Style.RESET_ALL)
@@ -72,56 +254,135 @@ def preprocess_data(df:pd.DataFrame) -> pd.DataFrame:
         df['snr'] = df['snr'].str.strip().astype(float)
 
     #----- Data Cleaning ----------------------------
-    # Temperature
-    df = df[(df["tmp"] > -20) & (df["tmp"] < 50)]
+    # All range rules and missing values in one mask, applied once
+    valid, violations = validate(df)
+    df_valid = df[valid]
 
-    # Humidity
-    df = df[(df["hum"] > 0) & (df["hum"] < 100)]
+    # Remove duplicated uplinks
+    duplicate = pd.Series(duplicated_readings(df_valid), index=df_valid.index)
+    df_valid = df_valid[~duplicate.to_numpy()]
 
-    # CO2
-    df = df[(df["CO2"] > 0) & (df["CO2"] < 10000)]
+    print("✓ Done")
+    print("\n")
 
-    # VOC
-    df = df[(df["VOC"] > 0) & (df["VOC"] < 10000)]
+    if not return_rejections:
+        return df_valid
 
-    # Remove duplicates
-    df = df.drop_duplicates()
+    violations["duplicate"] = False
+    violations.loc[duplicate.index, "duplicate"] = duplicate
+    violations["rejected"] = ~valid | violations["duplicate"].to_numpy()
+    violations.insert(0, "readings", 1)
+    if dates is None:
+        dates = df["date_time"].dt.normalize()
+    df_quality = violations.groupby([df["device_id"], dates.rename("date")]).sum().reset_index()
 
-    # Remove rows with NaN values in the used columns
-    df = df.dropna(subset=['tmp', 'hum', 'CO2', 'VOC'])
+    return df_valid, df_quality
 
-    print("✓ Done")
-    print("\n")
+def get_weather_data(start_date:str, end_date:str) -> pd.DataFrame:
+    """
+    Get the hourly weather data of Karlsruhe for the given date range.
+
+    Args:
+        start_date (str): The first date (YYYY-MM-DD).
+        end_date (str): The last date (YYYY-MM-DD).
+    """
+    print("Getting weather data...")
+    return utils.weather.get_weather_hourly(latitude=LATITUDE, longitude=LONGITUDE, start_date=start_date, end_date=end_date)
+
+def join_weather(df:pd.DataFrame, df_weather:pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the weather of the hour of every reading.
+
+    The readings are matched with the weather on the hour since the epoch (UTC), which is unique
+    also in the night of the change to winter time. The weather is sorted by hour, so the matching
+    row is found with a binary search instead of a hash merge on date and hour.
+
+    Args:
+        df (pd.DataFrame): The readings with date_time (local time) and room.
+        df_weather (pd.DataFrame): Hourly weather data from get_weather_data.
+    """
+    keys = utils.weather.local_hour_key(df["date_time"], groups=df["room"])
+    weather_keys = df_weather["hour_key"].to_numpy()
+
+    positions = np.searchsorted(weather_keys, keys)
+    found = positions < len(weather_keys)
+    found[found] = weather_keys[positions[found]] == keys[found]
+
+    for column in utils.weather.WEATHER_COLUMNS:
+        values = np.full(len(keys), np.nan)
+        values[found] = df_weather[column].to_numpy(dtype=float)[positions[found]]
+        df[column] = values
 
     return df
 
-def add_features(df: pd.DataFrame) -> pd.DataFrame:
+def backfill_weather(output_fpath:str, partitions:List[Tuple[str, str]]=None) -> List[Tuple[str, str]]:
+    """
+    Fill in the weather of stored readings that were processed before the weather of their hour
+    was in the archive (e.g. by the live ingest), as soon as it is.
+
+    Readings without any weather value are joined with the weather again. The (room, year_month)
+    partitions in which readings got weather are rewritten, their rollups have to be updated by
+    the caller.
+
+    Args:
+        output_fpath (str): The directory of the processed dataset.
+        partitions (List[Tuple[str, str]]): Only look at these partitions. All partitions if None.
+
+    Returns:
+        List[Tuple[str, str]]: The rewritten partitions.
+    """
+    weather_columns = utils.weather.WEATHER_COLUMNS
+    if partitions is None:
+        partitions = utils.storage.list_partitions(output_fpath)
+    if not partitions:
+        return []
+
+    df = utils.storage.read_partitions(output_fpath, partitions, columns=["room", "date_time"] + weather_columns)
+    df = df[df[weather_columns].isna().all(axis=1).to_numpy()]
+    if df.empty:
+        return []
+
+    dates = df["date_time"].dt.normalize()
+    df_weather = get_weather_data(dates.min().strftime("%Y-%m-%d"), dates.max().strftime("%Y-%m-%d"))
+    df = join_weather(df[["room", "date_time"]].copy(), df_weather)
+    filled = df[weather_columns].notna().any(axis=1).to_numpy()
+    if not filled.any():
+        return []
+
+    backfilled = sorted(set(zip(df["room"][filled].astype(str), utils.storage.year_month(df["date_time"][filled]))))
+    df_partitions = utils.storage.read_partitions(output_fpath, backfilled)
+    missing = df_partitions[weather_columns].isna().all(axis=1).to_numpy()
+    df_joined = join_weather(df_partitions.loc[missing, ["room", "date_time"]].copy(), df_weather)
+    for column in weather_columns:
+        df_partitions.loc[missing, column] = df_joined[column].to_numpy(dtype=df_partitions[column].dtype)
+    save_data(utils.storage.apply_schema(df_partitions), output_fpath, overwrite=False)
+
+    print(f"✓ Filled in the weather of {filled.sum()} readings")
+    return backfilled
+
+def add_features(df: pd.DataFrame, df_weather: pd.DataFrame = None) -> pd.DataFrame:
     """
     Adds additional features to the given DataFrame.
 
     Args:
         df (pd.DataFrame): The DataFrame to which the features will be added.
+        df_weather (pd.DataFrame): Hourly weather data covering the dates of df. Fetched if not given.
     """
     
     print(Style.BRIGHT + Fore.LIGHTMAGENTA_EX + "Adding Features")
     print(Style.RESET_ALL)
 
-    # ----- Room -------------------------------------
-    def extract_room(device_id):
-        room = device_id.replace("hka-aqm-n", "")
-        return room
-    
-    df['room'] = df['device_id'].apply(extract_room)
-
-    # ----- Floor -------------------------------------
-    def extract_floor(device_id):
-        floor = int(device_id.replace("hka-aqm-n", "")[0])
-        return floor
+    # ----- Room and floor ----------------------------
+    # Both are derived once per distinct device and broadcast to the rows by the device codes
+    device_codes, devices = pd.factorize(df["device_id"])
+    room_codes, rooms = pd.factorize(pd.Index(devices).str.replace("hka-aqm-n", ""))
+    df["room"] = pd.Categorical.from_codes(room_codes[device_codes], categories=rooms)
 
-    df['floor'] = df['device_id'].apply(extract_floor)
+    floor_codes, floors = pd.factorize(rooms.str[0].astype(int))
+    df["floor"] = pd.Categorical.from_codes(floor_codes[room_codes[device_codes]], categories=floors)
 
     #----- Add date -----------------------------------
-    df["date"] = df["date_time"].dt.date
+    df["date"] = df["date_time"].astype(utils.storage.PROCESSED_DTYPES["date"])
 
     #----- Add the month ------------------------------
     df["month"] = df["date_time"].dt.month
@@ -152,16 +413,12 @@ def add_features(df: pd.DataFrame) -> pd.DataFrame:
     })
 
     #----- Weather data -------------------------------
-    # Coordinates of Karlsruhe
-    latitude = 49.014920
-    longitude = 8.390050
-
-    start_date = df["date_time"].min().strftime("%Y-%m-%d")
-    end_date = df["date_time"].max().strftime("%Y-%m-%d")
+    if df_weather is None:
+        start_date = df["date_time"].min().strftime("%Y-%m-%d")
+        end_date = df["date_time"].max().strftime("%Y-%m-%d")
+        df_weather = get_weather_data(start_date, end_date)
 
-    print("Getting weather data...")
-    df_weather = utils.weather.get_weather_with_api(latitude=latitude, longitude=longitude, start_date=start_date, end_date=end_date)
-    df = pd.merge(df, df_weather, on=["date", "hour"], how="left")
+    df = join_weather(df, df_weather)
 
     #----- Remove unnecessary columns -----------------
     # Remove unneeded columns
@@ -177,38 +434,205 @@ def add_features(df: pd.DataFrame) -> pd.DataFrame:
         "gateway", 
         "channel_index", 
         "spreading_factor", 
-        "bandwidth", 
-        "f_cnt"])
+        "bandwidth"], errors="ignore")
+
+    #----- Compact dtypes -----------------------------
+    df = utils.storage.apply_schema(df)
     
     print("✓ Done")
     print("\n")
     
     return df
 
-def save_data(df:pd.DataFrame, output_fpath:str) -> None:
+def save_data(df:pd.DataFrame, output_fpath:str, overwrite:bool=True, append:bool=False) -> None:
     print(Style.BRIGHT + Fore.LIGHTMAGENTA_EX + "Saving Data")
     print(Style.RESET_ALL)
 
     """
-    Save the given DataFrame to a Parquet file.
+    Save the given DataFrame to the Parquet dataset partitioned by room and month.
 
     Args:
         df (pandas.DataFrame): The DataFrame to be saved.
-        output_path (str): The path to save the Parquet file.
+        output_path (str): The directory of the Parquet dataset.
+        overwrite (bool): Replace the whole dataset, otherwise only the partitions contained in df are replaced.
+        append (bool): Add df as new files to its partitions instead of replacing them.
     """
 
-    df.to_parquet(output_fpath, index=False)
+    utils.storage.write_dataset(df, output_fpath, overwrite=overwrite, append=append)
 
     print("✓ Done")
     print("\n")
 
-def pipeline(data_dir:str=None, output_fpath:str=None) -> bool:
+def replace_partitions(df:pd.DataFrame, partitions:List[Tuple[str, str]], output_fpath:str) -> pd.DataFrame:
+    """
+    Replace the rows of the given (room, date) partitions in the processed data with the rows of df.
+
+    Only the affected (room, month) partitions of the dataset are read. Dataset partitions that
+    end up without any rows are deleted. Readings of df that are already stored elsewhere have to
+    be removed before (see drop_stored_duplicates).
+
+    The stored rows are matched to the partitions by the date of the reading, the processed data
+    does not record the file of a reading. A reading of another day in a file (none in the data so
+    far) therefore stays when its file is replaced or removed.
+
+    Args:
+        df (pd.DataFrame): The newly processed rows.
+        partitions (List[Tuple[str, str]]): The (room, date) partitions to replace, as derived from the file names.
+        output_fpath (str): The directory of the processed dataset.
+
+    Returns:
+        pd.DataFrame: The updated content of the affected dataset partitions.
+    """
+    dataset_partitions = sorted({(room, date[:7]) for room, date in partitions})
+    df_existing = utils.storage.read_partitions(output_fpath, dataset_partitions)
+
+    if not df_existing.empty:
+        keys = pd.MultiIndex.from_arrays([df_existing["room"], pd.to_datetime(df_existing["date"]).dt.strftime("%Y-%m-%d")])
+        df_existing = df_existing[~keys.isin(partitions)]
+
+    df = utils.storage.apply_schema(pd.concat([df_existing, df], ignore_index=True))
+
+    if df.empty:
+        remaining = set()
+    else:
+        remaining = set(zip(df["room"], utils.storage.year_month(df["date_time"])))
+    utils.storage.delete_partitions(output_fpath, [p for p in dataset_partitions if p not in remaining])
+
+    return df
+
+def replace_quality(df_quality:pd.DataFrame, partitions:List[Tuple[str, str]], quality_fpath:str) -> None:
+    """
+    Replace the rows of the given (room, date) partitions in the data quality table. The rows are
+    keyed by the date of the file the readings were read from, so they match the partitions.
+
+    Args:
+        df_quality (pd.DataFrame): The rejection counts of the newly processed files (or None).
+        partitions (List[Tuple[str, str]]): The (room, date) partitions to replace, as derived from the file names.
+        quality_fpath (str): The path of the data quality table.
+    """
+    if os.path.exists(quality_fpath):
+        df_existing = pd.read_parquet(quality_fpath)
+        keys = pd.MultiIndex.from_arrays([
+            df_existing["device_id"].str.replace("hka-aqm-n", ""),
+            df_existing["date"].dt.strftime("%Y-%m-%d")
+        ])
+        df_existing = df_existing[~keys.isin(partitions)]
+    else:
+        df_existing = None
+
+    frames = [df for df in [df_existing, df_quality] if df is not None]
+    df_quality = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if df_quality.empty:
+        if os.path.exists(quality_fpath):
+            os.remove(quality_fpath)
+        return
+    df_quality = df_quality.sort_values(["device_id", "date"], ignore_index=True)
+    df_quality.to_parquet(quality_fpath, index=False)
+
+def drop_stored_duplicates(df:pd.DataFrame, output_fpath:str, replaced:List[Tuple[str, str]]=None) -> pd.DataFrame:
+    """
+    Remove the readings of df that are already stored in the processed data. Only the identifying
+    columns of the affected (room, month) partitions are read.
+
+    Args:
+        df (pd.DataFrame): The newly processed rows.
+        output_fpath (str): The directory of the processed dataset.
+        replaced (List[Tuple[str, str]]): (room, date) partitions that are about to be replaced,
+            their stored rows are not compared.
+
+    Returns:
+        pd.DataFrame: The rows of df that are not stored yet.
+    """
+    dataset_partitions = sorted(set(zip(df["room"], utils.storage.year_month(df["date_time"]))))
+    columns = ["room", "date_time", "f_cnt"] + (["date"] if replaced else [])
+    df_stored = utils.storage.read_partitions(output_fpath, dataset_partitions, columns=columns)
+    if not df_stored.empty and replaced:
+        keys = pd.MultiIndex.from_arrays([df_stored["room"], pd.to_datetime(df_stored["date"]).dt.strftime("%Y-%m-%d")])
+        df_stored = df_stored[~keys.isin(replaced)][["room", "date_time", "f_cnt"]]
+    if df_stored.empty:
+        return df
+
+    keys = pd.concat([df_stored, df[["room", "date_time", "f_cnt"]]], ignore_index=True)
+    duplicate = duplicated_readings(keys, device_column="room")[len(df_stored):]
+    return df[~duplicate]
+
+def process_files(
+        fpaths:List[str],
+        df_weather:pd.DataFrame=None,
+        output_fpath:str=None,
+        replaced:List[Tuple[str, str]]=None
+    ) -> Tuple[pd.DataFrame, Dict[str, int], pd.DataFrame]:
+    """
+    Load, preprocess and add features to the given .dat files.
+
+    The data quality table counts the readings per device and date of the file they were read from.
+    With an output_fpath the readings that are already stored in the processed data are dropped
+    and counted as duplicates.
+
+    Args:
+        fpaths (List[str]): The paths of the .dat files.
+        df_weather (pd.DataFrame): Hourly weather data covering the files. Fetched if not given.
+        output_fpath (str): The directory of the processed dataset.
+        replaced (List[Tuple[str, str]]): (room, date) partitions of the processed data that are
+            about to be replaced (see drop_stored_duplicates).
+
+    Returns:
+        Tuple[pd.DataFrame, Dict[str, int], pd.DataFrame]: The processed data (None if nothing could
+        be loaded), the number of raw rows of every loaded file and the data quality table.
+    """
+    df, rows = load_files(fpaths, columns=RAW_COLUMNS)
+    if df.empty:
+        return None, rows, None
+
+    # load_files concatenates the files in the order of rows
+    file_dates = [utils.manifest.file_partition(fpath)[1] for fpath in rows]
+    dates = pd.Series(pd.to_datetime(np.repeat(file_dates, list(rows.values()))), index=df.index)
+
+    df_preprocessed, df_quality = preprocess_data(df, return_rejections=True, dates=dates)
+    del df
+    df_features = add_features(df_preprocessed, df_weather=df_weather)
+
+    if output_fpath is not None:
+        df_new = drop_stored_duplicates(df_features, output_fpath, replaced=replaced)
+        df_stored = df_features.loc[df_features.index.difference(df_new.index)]
+        if not df_stored.empty:
+            duplicates = pd.Series(1, index=pd.MultiIndex.from_arrays(
+                ["hka-aqm-n" + df_stored["room"].astype(str), dates[df_stored.index]], names=["device_id", "date"]
+            )).groupby(level=["device_id", "date"]).sum()
+            df_quality = df_quality.set_index(["device_id", "date"])
+            df_quality["duplicate"] = df_quality["duplicate"].add(duplicates, fill_value=0).astype("int64")
+            df_quality["rejected"] = df_quality["rejected"].add(duplicates, fill_value=0).astype("int64")
+            df_quality = df_quality.reset_index()
+        df_features = df_new
+
+    return df_features, rows, df_quality
+
+def pipeline(data_dir:str=None, output_fpath:str=None, incremental:bool=True, chunk_size:int=None) -> bool:
     """
     A function that performs a data pipeline process.
 
+    In incremental mode only files that are new or changed since the last run (according to the
+    manifest next to the output) are ingested, and only the dataset partitions containing their
+    (room, date) partitions are rewritten. Without a manifest or output the data is processed from scratch.
+
+    Stored readings that have no weather yet (their hour was not in the archive when they were
+    processed) get it as soon as it is available, see backfill_weather.
+
+    The hourly and daily rollups (see utils/rollups.py), the device health table (see
+    utils/health.py) and the CO2 episodes (see utils/events.py) of all changed partitions are recomputed.
+    The number of readings rejected by every validation rule is written per device and day to
+    data_quality.parquet next to the output.
+
+    With a chunk_size the files are streamed through the pipeline chunk_size files at a time and
+    every chunk is written to the dataset before the next one is loaded, so the peak memory is
+    bounded by the chunk size instead of the whole history. When rebuilding, the chunks are appended
+    and the files of every partition are merged at the end.
+
     Args:
         data_dir (str): The directory path where the data (all .dat files) is located.
-        output_fpath (str): The file path to save the processed data.
+        output_fpath (str): The directory to save the processed dataset.
+        incremental (bool): Only ingest new or changed files.
+        chunk_size (int): Number of files processed at once. All files at once if None.
 
     Returns:
         bool: True if the pipeline process is successful, False otherwise.
@@ -220,11 +644,88 @@ def pipeline(data_dir:str=None, output_fpath:str=None) -> bool:
         data_dir = os.path.join(working_dir, "data")
     if output_fpath is None:
         output_fpath = os.path.join(working_dir, "data/processed/data_building_n.parquet")
-
-    df = load_data(f"{data_dir}/hka-aqm-n")
-    df_preprocessed = preprocess_data(df)
-    df_features = add_features(df_preprocessed)
-    save_data(df_features, output_fpath)
+    manifest_fpath = os.path.join(os.path.dirname(output_fpath), "manifest.parquet")
+    quality_fpath = os.path.join(os.path.dirname(output_fpath), "data_quality.parquet")
+
+    if not incremental or not os.path.isdir(output_fpath):
+        manifest = utils.manifest.read_manifest(manifest_fpath).iloc[0:0]
+    else:
+        manifest = utils.manifest.read_manifest(manifest_fpath)
+
+    # Readings stored before the weather of their hour was available
+    backfilled = backfill_weather(output_fpath) if incremental and os.path.isdir(output_fpath) else []
+
+    manifest, changed, removed = utils.manifest.scan(f"{data_dir}/hka-aqm-n", manifest)
+    if not changed and not removed:
+        utils.rollups.update(output_fpath, backfilled)
+        print("✓ Processed data is up to date")
+        return True
+    print(f"{len(changed)} new or changed files, {len(removed)} removed files")
+
+    # Nothing of the existing output is kept, so the dataset is rebuilt
+    rebuild = len(manifest) == len(changed) and not removed
+    if rebuild:
+        utils.storage.delete_dataset(output_fpath)
+        for resolution in utils.rollups.RESOLUTIONS:
+            utils.storage.delete_dataset(utils.rollups.rollup_dir(output_fpath, resolution))
+        if os.path.exists(quality_fpath):
+            os.remove(quality_fpath)
+        for fpath in [utils.health.health_fpath(output_fpath), utils.events.events_fpath(output_fpath)]:
+            if os.path.exists(fpath):
+                os.remove(fpath)
+
+    if removed:
+        partitions = [utils.manifest.file_partition(fpath) for fpath in removed]
+        df_partitions = replace_partitions(None, partitions, output_fpath)
+        if not df_partitions.empty:
+            save_data(df_partitions, output_fpath, overwrite=False)
+
+    df_weather = None
+    if changed:
+        dates = sorted(utils.manifest.file_partition(fpath)[1] for fpath in changed)
+        # A file can start with readings of the day before
+        first_date = (pd.Timestamp(dates[0]) - pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+        df_weather = get_weather_data(first_date, dates[-1])
+
+    chunk_size = chunk_size or max(len(changed), 1)
+    rows = {}
+    qualities = []
+    appended = set()
+    for i in range(0, len(changed), chunk_size):
+        chunk = changed[i:i + chunk_size]
+        if len(changed) > chunk_size:
+            print(f"Chunk {i // chunk_size + 1}/{-(-len(changed) // chunk_size)}")
+
+        # Readings that are already stored (e.g. in the file of another day) are not added again.
+        # The partitions of this and the following chunks are replaced, so they are not compared.
+        replaced = None if rebuild else [utils.manifest.file_partition(fpath) for fpath in changed[i:]]
+        df_features, chunk_rows, df_quality = process_files(chunk, df_weather=df_weather, output_fpath=output_fpath, replaced=replaced)
+        rows.update(chunk_rows)
+        if df_quality is not None:
+            qualities.append(df_quality)
+
+        if rebuild:
+            if df_features is not None:
+                save_data(df_features, output_fpath, overwrite=False, append=True)
+                appended.update(zip(df_features["room"], utils.storage.year_month(df_features["date_time"])))
+        else:
+            partitions = [utils.manifest.file_partition(fpath) for fpath in chunk]
+            df_partitions = replace_partitions(df_features, partitions, output_fpath)
+            if not df_partitions.empty:
+                save_data(df_partitions, output_fpath, overwrite=False)
+        del df_features
+
+    # Every chunk added a file to its partitions, they are merged into one file per partition
+    utils.storage.compact_partitions(output_fpath, sorted(appended))
+
+    partitions = [utils.manifest.file_partition(fpath) for fpath in changed + removed]
+    utils.rollups.update(output_fpath, [(room, date[:7]) for room, date in partitions] + backfilled)
+    utils.health.update(output_fpath, [(room, date[:7]) for room, date in partitions])
+    utils.events.update(output_fpath, [(room, date[:7]) for room, date in partitions])
+    # Also without new quality rows, e.g. if only files were removed or none of the files could be read
+    replace_quality(pd.concat(qualities, ignore_index=True) if qualities else None, partitions, quality_fpath)
+
+    utils.manifest.write_manifest(utils.manifest.update_rows(manifest, rows), manifest_fpath)
     return True
 
 def pipeline_from_df(df):
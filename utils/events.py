@@ -0,0 +1,128 @@
+import os
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import utils.storage
+
+# Episodes in which the CO2 concentration of a room exceeded the limits of the HKA traffic light
+# (the bands of utils.dashboard.get_main_fig), maintained next to the processed data as
+# co2_events.parquet with one row per room, threshold and episode:
+#   room, threshold, start, end (first and last reading above the threshold), duration, readings, peak
+# The 1200 ppm episodes lie within 850 ppm episodes.
+
+EVENTS_FNAME = "co2_events.parquet"
+
+CO2_THRESHOLDS = [850, 1200]
+
+# Readings arrive about every 15 minutes, a longer silence ends an episode
+MAX_GAP = pd.Timedelta(hours=1)
+
+def events_fpath(output_fpath:str) -> str:
+    """ Returns the path of the CO2 event table of the processed dataset at output_fpath. """
+    return os.path.join(os.path.dirname(output_fpath), EVENTS_FNAME)
+
+def detect(df:pd.DataFrame, thresholds:List[int]=CO2_THRESHOLDS) -> pd.DataFrame:
+    """
+    Find the episodes in which CO2 was above the thresholds, for all rooms at once.
+
+    The readings above a threshold are run-length encoded: a run starts at a reading above the
+    threshold whose predecessor (of the same room, at most MAX_GAP before) is not, and ends at a
+    reading whose successor is not above the threshold.
+
+    Args:
+        df (pd.DataFrame): Processed data with the columns room, date_time and CO2.
+        thresholds (List[int]): The CO2 limits in ppm.
+
+    Returns:
+        pd.DataFrame: One row per room, threshold and episode, sorted by room, threshold and start.
+    """
+    df = df[["room", "date_time", "CO2"]].sort_values(["room", "date_time"], ignore_index=True, kind="stable")
+    rooms = df["room"].astype(str).to_numpy()
+    codes = df["room"].cat.codes.to_numpy() if df["room"].dtype == "category" else pd.factorize(rooms)[0]
+    times = df["date_time"].to_numpy()
+    co2 = df["CO2"].to_numpy(dtype="float64", na_value=np.nan)
+
+    # A reading continues the series of its predecessor if it is of the same room and not too far apart
+    continues = np.zeros(len(df), dtype=bool)
+    continues[1:] = (codes[1:] == codes[:-1]) & (np.diff(times) <= MAX_GAP.to_timedelta64())
+
+    episodes = []
+    for threshold in thresholds:
+        above = co2 > threshold
+        above_before = np.zeros(len(df), dtype=bool)
+        above_before[1:] = above[:-1]
+        above_after = np.zeros(len(df), dtype=bool)
+        above_after[:-1] = above[1:] & continues[1:]
+
+        starts = np.flatnonzero(above & ~(above_before & continues))
+        ends = np.flatnonzero(above & ~above_after)
+        peaks = np.maximum.reduceat(np.where(above, co2, -np.inf), starts) if len(starts) else np.array([])
+
+        episodes.append(pd.DataFrame({
+            "room": rooms[starts],
+            "threshold": np.full(len(starts), threshold, dtype="int16"),
+            "start": times[starts],
+            "end": times[ends],
+            "duration": times[ends] - times[starts],
+            "readings": (ends - starts + 1).astype("int32"),
+            "peak": peaks.astype("float32"),
+        }))
+
+    df_events = pd.concat(episodes, ignore_index=True)
+    return df_events.sort_values(["room", "threshold", "start"], ignore_index=True)
+
+def read_events(output_fpath:str) -> pd.DataFrame:
+    """ Read the CO2 event table, it is built first if it does not exist yet. """
+    fpath = events_fpath(output_fpath)
+    if not os.path.exists(fpath):
+        rebuild(output_fpath)
+    return pd.read_parquet(fpath)
+
+def update(output_fpath:str, partitions:List[Tuple[str, str]]) -> None:
+    """
+    Update the episodes of the rooms with the given changed (room, year_month) partitions.
+
+    Per room the episodes are recomputed from the start of the earliest changed month. If a stored
+    episode may continue into that month (it ends less than MAX_GAP before), the recomputation
+    starts with this episode instead, so no episode is cut in two.
+
+    Args:
+        output_fpath (str): The directory of the processed dataset.
+        partitions (List[Tuple[str, str]]): The changed partitions.
+    """
+    fpath = events_fpath(output_fpath)
+    df_events = pd.read_parquet(fpath) if os.path.exists(fpath) else None
+
+    starts = {}
+    for room, ym in partitions:
+        month_start = pd.Timestamp(f"{ym}-01")
+        starts[room] = min(starts.get(room, month_start), month_start)
+
+    kept = []
+    computed = []
+    for room, start in sorted(starts.items()):
+        if df_events is not None:
+            df_room = df_events[df_events["room"] == room]
+            continuing = df_room[df_room["end"] >= start - MAX_GAP]
+            if not continuing.empty:
+                start = min(start, continuing["start"].min())
+            kept.append(df_room[df_room["end"] < start])
+
+        df = utils.storage.read_dataset(output_fpath, room=room, start=start, columns=["room", "date_time", "CO2"])
+        if not df.empty:
+            computed.append(detect(df))
+
+    if df_events is not None:
+        kept.append(df_events[~df_events["room"].isin(list(starts))])
+    if not kept and not computed:
+        return
+    df_events = pd.concat(kept + computed, ignore_index=True)
+    df_events = df_events.sort_values(["room", "threshold", "start"], ignore_index=True)
+    df_events.to_parquet(fpath, index=False)
+
+def rebuild(output_fpath:str) -> None:
+    """ Detect the episodes of the whole processed dataset. """
+    df = utils.storage.read_dataset(output_fpath, columns=["room", "date_time", "CO2"])
+    detect(df).to_parquet(events_fpath(output_fpath), index=False)
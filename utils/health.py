@@ -0,0 +1,144 @@
+import os
+from itertools import groupby
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import utils.storage
+
+# Health of the sensors, maintained next to the processed data as device_health.parquet with one
+# row per room (device) and day: the number of readings, the first and last reading of the day and
+# the number of gaps within the day. The status of all devices at a point in time is derived from
+# this small table instead of the readings.
+
+HEALTH_FNAME = "device_health.parquet"
+
+# Readings arrive about every 15 minutes, a longer silence is counted as a gap
+GAP = pd.Timedelta(hours=1)
+
+# Status by the time since the last reading, as in the Rooms page
+STATUS_LIMITS = [("Good", pd.Timedelta(days=1)), ("Warning", pd.Timedelta(days=2))]
+STATUSES = ["Good", "Warning", "Critical"]
+
+def health_fpath(output_fpath:str) -> str:
+    """ Returns the path of the health table of the processed dataset at output_fpath. """
+    return os.path.join(os.path.dirname(output_fpath), HEALTH_FNAME)
+
+def compute(df:pd.DataFrame) -> pd.DataFrame:
+    """
+    Compute the health table rows of processed data.
+
+    Args:
+        df (pd.DataFrame): Processed data with the columns room and date_time.
+
+    Returns:
+        pd.DataFrame: One row per room and day with readings, first_seen, last_seen and gaps
+            (gaps between two readings of the same day).
+    """
+    df = df[["room", "date_time"]].sort_values(["room", "date_time"], ignore_index=True)
+    codes = df["room"].cat.codes
+    date = df["date_time"].dt.normalize()
+    same_day = (codes == codes.shift()) & (date == date.shift())
+    gap = (df["date_time"].diff() > GAP) & same_day
+
+    grouped = df.assign(date=date, gap=gap).groupby(["room", "date"], observed=True)
+    df_health = grouped.agg(
+        readings=("date_time", "size"),
+        first_seen=("date_time", "min"),
+        last_seen=("date_time", "max"),
+        gaps=("gap", "sum"),
+    ).reset_index()
+    df_health["room"] = df_health["room"].astype(str)
+    return df_health.astype({"readings": "int32", "gaps": "int32"})
+
+def update(output_fpath:str, partitions:List[Tuple[str, str]]) -> None:
+    """
+    Recompute the health table rows of the given (room, year_month) partitions of the processed data.
+
+    Args:
+        output_fpath (str): The directory of the processed dataset.
+        partitions (List[Tuple[str, str]]): The changed partitions.
+    """
+    fpath = health_fpath(output_fpath)
+    partitions = sorted(set(partitions))
+
+    df_health = pd.read_parquet(fpath) if os.path.exists(fpath) else None
+    if df_health is not None:
+        month = df_health["date"].dt.strftime("%Y-%m")
+        replaced = pd.Series(list(zip(df_health["room"], month)), index=df_health.index).isin(set(partitions))
+        df_health = df_health[~replaced.to_numpy()]
+
+    computed = []
+    for room, room_partitions in groupby(partitions, key=lambda p: p[0]):
+        df = utils.storage.read_partitions(output_fpath, list(room_partitions), columns=["room", "date_time"])
+        if not df.empty:
+            computed.append(compute(df))
+
+    df_health = pd.concat([df for df in [df_health, *computed] if df is not None], ignore_index=True)
+    if df_health.empty:
+        if os.path.exists(fpath):
+            os.remove(fpath)
+        return
+    df_health = df_health.sort_values(["room", "date"], ignore_index=True)
+    df_health.to_parquet(fpath, index=False)
+
+def rebuild(output_fpath:str) -> None:
+    """ Recompute the health table of the whole processed dataset. """
+    fpath = health_fpath(output_fpath)
+    if os.path.exists(fpath):
+        os.remove(fpath)
+    update(output_fpath, utils.storage.list_partitions(output_fpath))
+
+def read_health(output_fpath:str) -> pd.DataFrame:
+    """ Read the health table, it is built first if it does not exist yet. """
+    fpath = health_fpath(output_fpath)
+    if not os.path.exists(fpath):
+        rebuild(output_fpath)
+    return pd.read_parquet(fpath)
+
+def device_status(df_health:pd.DataFrame, at:pd.Timestamp, window:pd.Timedelta=pd.Timedelta(days=1)) -> pd.DataFrame:
+    """
+    Status of every device at a point in time.
+
+    The uplink rate and the gaps are taken from the complete days in the window before at. Of the
+    day of at only the readings up to at are considered (for at at midnight this is exact).
+
+    Args:
+        df_health (pd.DataFrame): The health table.
+        at (pd.Timestamp): The point in time, e.g. now or the simulation date.
+        window (pd.Timedelta): The period for the uplink rate and the gaps, in whole days.
+
+    Returns:
+        pd.DataFrame: Per room (index) last_seen, since (time since the last reading), readings,
+            uplinks_per_hour and gaps in the window and the status, sorted from Critical to Good.
+    """
+    at = pd.Timestamp(at)
+    day = at.normalize()
+
+    # The last reading up to at: all days before, of the current day the first reading is the
+    # latest known one unless the whole day is before at
+    df_seen = df_health[(df_health["date"] < day) | ((df_health["date"] == day) & (df_health["first_seen"] <= at))]
+    last = df_seen["last_seen"].where(df_seen["last_seen"] <= at, df_seen["first_seen"])
+    last_seen = last.groupby(df_seen["room"]).max().rename("last_seen")
+
+    df_window = df_health[(df_health["date"] >= day - window.ceil("D")) & (df_health["date"] < day)]
+    # Gaps between the last reading of a day and the first reading of the next day in the window
+    same_room = df_window["room"] == df_window["room"].shift()
+    overnight = same_room & (df_window["first_seen"] - df_window["last_seen"].shift() > GAP)
+    grouped = df_window.assign(overnight=overnight).groupby("room")
+    readings = grouped["readings"].sum()
+    gaps = grouped["gaps"].sum() + grouped["overnight"].sum()
+
+    df_status = pd.DataFrame({"last_seen": last_seen})
+    df_status["since"] = at - df_status["last_seen"]
+    df_status["readings"] = readings.reindex(df_status.index, fill_value=0).astype("int64")
+    df_status["uplinks_per_hour"] = df_status["readings"] / (window.ceil("D") / pd.Timedelta(hours=1))
+    df_status["gaps"] = gaps.reindex(df_status.index, fill_value=0).astype("int64")
+
+    conditions = [df_status["since"] <= limit for _, limit in STATUS_LIMITS]
+    df_status["status"] = pd.Categorical(
+        np.select(conditions, [status for status, _ in STATUS_LIMITS], default="Critical"), categories=STATUSES
+    )
+    df_status.index.name = "room"
+    return df_status.sort_values(["status", "since"], ascending=[False, False])
@@ -0,0 +1,306 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+current_dir = os.getcwd()
+git_root = subprocess.check_output(["git", "rev-parse", "--show-toplevel"], cwd=current_dir)
+git_root = git_root.decode("utf-8").strip()
+os.chdir(git_root)
+sys.path.append(git_root)
+
+from typing import Dict, List, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv
+from colorama import Fore, Style
+
+import utils.data_pipeline
+import utils.events
+import utils.health
+import utils.manifest
+import utils.rollups
+import utils.storage
+import utils.weather
+
+# Live ingest of the logger output. The logger appends every uplink as a line to the .dat file of
+# the device and day, so the files of the current day are polled and only the bytes behind the
+# last read offset are parsed. The offsets are kept in a state file next to the processed data:
+#   {"data/hka-aqm-n/hka-aqm-n002_2022_09_01.dat": {"offset": 12345, "columns": ["date_time", ...]}}
+#
+# The micro-batches are appended to the processed data right away. The partitions they touched
+# are collected in a second file and only compacted, and their rollups, device health and CO2
+# episodes updated, every derived_interval seconds (see update_derived):
+#   {"partitions": [["002", "2022-09"], ...]}
+
+STATE_FNAME = "ingest_state.json"
+PENDING_FNAME = "ingest_pending.json"
+
+def read_state(state_fpath:str) -> Dict[str, dict]:
+    """ Read the ingest state, an empty state is returned if it does not exist yet. """
+    if not os.path.exists(state_fpath):
+        return {}
+    with open(state_fpath) as f:
+        return json.load(f)
+
+def write_state(state:Dict[str, dict], state_fpath:str) -> None:
+    """ Write the ingest state. The file is replaced at once, so it is never half written. """
+    tmp_fpath = state_fpath + ".tmp"
+    with open(tmp_fpath, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_fpath, state_fpath)
+
+def initial_state(manifest:pd.DataFrame) -> Dict[str, dict]:
+    """ Start tailing every file of the manifest behind the part that the pipeline already ingested. """
+    return {fpath: {"offset": int(size), "columns": None} for fpath, size in zip(manifest["path"], manifest["size"])}
+
+def read_header(fpath:str) -> List[str]:
+    """ Returns the column names of a .dat file (second line) or None if the header is not complete yet. """
+    with open(fpath, "rb") as f:
+        lines = f.read(4096).split(b"\n")
+    if len(lines) < 3:
+        return None
+    return [name.strip() for name in lines[1].decode("utf-8").split(";")]
+
+def read_new_lines(fpath:str, offset:int) -> Tuple[bytes, int]:
+    """
+    Read the complete lines that were appended to a file since the offset.
+
+    A partially written last line is left for the next poll. If the offset does not point to the
+    start of a line (e.g. the pipeline read the file while a line was written), the rest of that
+    line is skipped as it was already ingested.
+
+    Args:
+        fpath (str): The path of the .dat file.
+        offset (int): The number of bytes already read.
+
+    Returns:
+        Tuple[bytes, int]: The new lines and the new offset.
+    """
+    with open(fpath, "rb") as f:
+        f.seek(max(offset - 1, 0))
+        data = f.read()
+
+    if offset > 0:
+        if data[:1] != b"\n":
+            line_end = data.find(b"\n")
+            if line_end < 0:
+                return b"", offset
+            offset += line_end
+            data = data[line_end:]
+        data = data[1:]
+
+    end = data.rfind(b"\n") + 1
+    return data[:end], offset + end
+
+def parse_lines(data:bytes, columns:List[str]) -> pa.Table:
+    """ Parse lines of a .dat file (without the header) into an Arrow table with DAT_SCHEMA types. """
+    return pyarrow.csv.read_csv(
+        pa.BufferReader(data),
+        read_options=pyarrow.csv.ReadOptions(column_names=columns, use_threads=False),
+        parse_options=pyarrow.csv.ParseOptions(delimiter=";"),
+        convert_options=pyarrow.csv.ConvertOptions(
+            column_types=utils.data_pipeline.DAT_SCHEMA,
+            include_columns=utils.data_pipeline.RAW_COLUMNS,
+            include_missing_columns=True
+        )
+    )
+
+def poll(data_dir:str, state:Dict[str, dict]) -> List[pa.Table]:
+    """
+    Read the new lines of all .dat files in data_dir and advance their offsets in state.
+
+    Args:
+        data_dir (str): The directory with the .dat files.
+        state (Dict[str, dict]): The ingest state, updated in place.
+
+    Returns:
+        List[pa.Table]: The new readings per file.
+    """
+    tables = []
+    for entry in os.scandir(data_dir):
+        if not entry.name.endswith(".dat"):
+            continue
+        fpath = os.path.relpath(entry.path)
+        file_state = state.setdefault(fpath, {"offset": 0, "columns": None})
+        size = entry.stat().st_size
+
+        if size < file_state["offset"]:
+            # The file was rewritten, already stored readings are dropped as duplicates
+            file_state["offset"], file_state["columns"] = 0, None
+        if size == file_state["offset"]:
+            continue
+
+        if file_state["columns"] is None:
+            file_state["columns"] = read_header(fpath)
+            if file_state["columns"] is None:
+                continue
+
+        data, offset = read_new_lines(fpath, file_state["offset"])
+        if file_state["offset"] == 0:
+            # Skip the logger comment and the header
+            header_end = data.find(b"\n", data.find(b"\n") + 1) + 1
+            data = data[header_end:]
+        file_state["offset"] = offset
+        if not data:
+            continue
+
+        try:
+            tables.append(parse_lines(data, file_state["columns"]))
+        except Exception as e:
+            print(Fore.RED + f"Skipping unreadable lines of {fpath}: {e}")
+            print(Style.RESET_ALL)
+
+    return tables
+
+def recent_weather() -> pd.DataFrame:
+    """ Returns the hourly weather data of yesterday and today, as far as it is available. """
+    today = pd.Timestamp.now()
+    return utils.data_pipeline.get_weather_data((today - pd.Timedelta(days=1)).strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d"))
+
+def weather_missing(df_weather:pd.DataFrame, tables:List[pa.Table]) -> bool:
+    """ Returns whether the weather of the hour of the newest reading in tables is not in df_weather. """
+    if df_weather is None:
+        return True
+    latest = [pc.max(table["date_time"]).as_py() for table in tables]
+    latest = [t for t in latest if t is not None]
+    if not latest:
+        return False
+    key = utils.weather.local_hour_key(pd.Series([pd.Timestamp(max(latest))]))[0]
+    return not (df_weather["hour_key"] == key).any()
+
+def pending_fpath(output_fpath:str) -> str:
+    """ Returns the path of the file with the partitions that wait for update_derived. """
+    return os.path.join(os.path.dirname(output_fpath), PENDING_FNAME)
+
+def add_pending(output_fpath:str, partitions:List[Tuple[str, str]]) -> None:
+    """ Remember partitions for the next update_derived, also across restarts. """
+    fpath = pending_fpath(output_fpath)
+    pending = {tuple(p) for p in read_state(fpath).get("partitions", [])}
+    write_state({"partitions": sorted(pending | set(partitions))}, fpath)
+
+def update_derived(output_fpath:str) -> int:
+    """
+    Compact the partitions that were appended to since the last call, fill in the weather their
+    readings were stored without (see utils.data_pipeline.backfill_weather) and update their
+    rollups, device health and CO2 episodes.
+
+    These updates read and rewrite whole (room, month) partitions, so they are not run for every
+    micro-batch but at a slower interval by watch and the uplink receiver. Until then the new
+    readings are only in the processed data.
+
+    Returns:
+        int: The number of updated partitions.
+    """
+    fpath = pending_fpath(output_fpath)
+    partitions = [tuple(p) for p in read_state(fpath).get("partitions", [])]
+    if not partitions:
+        return 0
+
+    utils.storage.compact_partitions(output_fpath, partitions)
+    utils.data_pipeline.backfill_weather(output_fpath, partitions)
+    utils.rollups.update(output_fpath, partitions)
+    utils.health.update(output_fpath, partitions)
+    utils.events.update(output_fpath, partitions)
+    os.remove(fpath)
+    return len(partitions)
+
+def ingest_batch(tables:List[pa.Table], output_fpath:str, df_weather:pd.DataFrame) -> int:
+    """
+    Process new readings and append them to the processed data. The affected partitions are
+    added to the pending partitions of update_derived.
+
+    Args:
+        tables (List[pa.Table]): The new readings.
+        output_fpath (str): The directory of the processed dataset.
+        df_weather (pd.DataFrame): Hourly weather data, hours that are not available yet stay empty.
+
+    Returns:
+        int: The number of appended rows.
+    """
+    df = pa.concat_tables(tables).to_pandas()
+    df_preprocessed = utils.data_pipeline.preprocess_data(df)
+    if df_preprocessed.empty:
+        return 0
+
+    df_features = utils.data_pipeline.add_features(df_preprocessed, df_weather=df_weather)
+    df_features = utils.data_pipeline.drop_stored_duplicates(df_features, output_fpath)
+    if not df_features.empty:
+        utils.data_pipeline.save_data(df_features, output_fpath, overwrite=False, append=True)
+        partitions = set(zip(df_features["room"], utils.storage.year_month(df_features["date_time"])))
+        add_pending(output_fpath, list(partitions))
+    return len(df_features)
+
+def watch(
+        data_dir:str=None,
+        output_fpath:str=None,
+        interval:float=2.0,
+        weather_interval:float=300.0,
+        derived_interval:float=60.0
+    ) -> None:
+    """
+    Continuously ingest the readings the logger appends to the .dat files.
+
+    On the first start the pipeline is run to catch up with the existing files. Afterwards the
+    directory is polled every interval seconds and new lines are appended to the processed data
+    as micro-batches. The weather data is refreshed when the hour of the newest reading is not in
+    it, at most every weather_interval seconds. The archive usually lags the current hour, so the
+    readings are stored without weather first and update_derived fills it in once it is available
+    (see utils.data_pipeline.backfill_weather). The rollups, device health and CO2 episodes follow
+    every derived_interval seconds.
+
+    Args:
+        data_dir (str): The directory path where the data (all .dat files) is located.
+        output_fpath (str): The directory of the processed dataset.
+        interval (float): Seconds between two polls.
+        weather_interval (float): Minimum seconds between two updates of the weather data.
+        derived_interval (float): Seconds between two updates of the rollups, device health and CO2 episodes.
+    """
+    if data_dir is None:
+        data_dir = "data"
+    if output_fpath is None:
+        output_fpath = "data/processed/data_building_n.parquet"
+    dat_dir = os.path.join(data_dir, "hka-aqm-n")
+    state_fpath = os.path.join(os.path.dirname(output_fpath), STATE_FNAME)
+    manifest_fpath = os.path.join(os.path.dirname(output_fpath), "manifest.parquet")
+
+    state = read_state(state_fpath)
+    if not state:
+        utils.data_pipeline.pipeline(data_dir, output_fpath)
+        state = initial_state(utils.manifest.read_manifest(manifest_fpath))
+        write_state(state, state_fpath)
+
+    print(Style.BRIGHT + Fore.LIGHTMAGENTA_EX + f"Watching {dat_dir}")
+    print(Style.RESET_ALL)
+
+    # Partitions left over from a previous run
+    update_derived(output_fpath)
+
+    df_weather = None
+    weather_time = 0.0
+    derived_time = time.time()
+    while True:
+        poll_time = time.time()
+        tables = poll(dat_dir, state)
+
+        if tables:
+            if weather_missing(df_weather, tables) and time.time() - weather_time > weather_interval:
+                df_weather = recent_weather()
+                weather_time = time.time()
+
+            rows = ingest_batch(tables, output_fpath, df_weather)
+            write_state(state, state_fpath)
+            print(f"✓ Ingested {rows} rows in {time.time() - poll_time:.1f}s")
+
+        if time.time() - derived_time >= derived_interval:
+            derived_time = time.time()
+            if update_derived(output_fpath):
+                print(f"✓ Updated rollups, health and events in {time.time() - derived_time:.1f}s")
+
+        time.sleep(max(interval - (time.time() - poll_time), 0))
+
+if __name__ == "__main__":
+    watch()
@@ -0,0 +1,93 @@
+import hashlib
+import os
+import re
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+MANIFEST_COLUMNS = ["path", "size", "mtime", "hash", "rows"]
+
+# Row count of files that could not be parsed, they are only tried again when they change
+FAILED_ROWS = -1
+
+# Every .dat file holds the readings of one device for one day, e.g. hka-aqm-n002_2022_09_01.dat
+DAT_FILE_PATTERN = re.compile(r"hka-aqm-n(?P<room>\w+?)_(?P<year>\d{4})_(?P<month>\d{2})_(?P<day>\d{2})\.dat$")
+
+def file_hash(fpath:str, chunk_size:int=1 << 20) -> str:
+    """ Hash the content of a file. """
+    h = hashlib.blake2b(digest_size=16)
+    with open(fpath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def file_partition(fpath:str) -> Tuple[str, str]:
+    """ Returns the (room, date) partition of a .dat file, derived from its name. """
+    match = DAT_FILE_PATTERN.search(os.path.basename(fpath))
+    if match is None:
+        raise ValueError(f"Unexpected file name {fpath}")
+    return match["room"], f"{match['year']}-{match['month']}-{match['day']}"
+
+def read_manifest(manifest_fpath:str) -> pd.DataFrame:
+    """ Read the manifest, an empty manifest is returned if it does not exist yet. """
+    if not os.path.exists(manifest_fpath):
+        return pd.DataFrame(columns=MANIFEST_COLUMNS)
+    return pd.read_parquet(manifest_fpath)
+
+def write_manifest(manifest:pd.DataFrame, manifest_fpath:str) -> None:
+    """ Write the manifest sorted by path. """
+    manifest = manifest[MANIFEST_COLUMNS].sort_values("path").reset_index(drop=True)
+    manifest.to_parquet(manifest_fpath, index=False)
+
+def scan(data_dir:str, manifest:pd.DataFrame) -> Tuple[pd.DataFrame, List[str], List[str]]:
+    """
+    Compare the .dat files of a directory with the manifest.
+
+    Files with the same size and mtime as in the manifest are considered unchanged without reading
+    them. Otherwise the content hash decides, so a file that was only touched is not ingested again.
+
+    Args:
+        data_dir (str): The directory with the .dat files.
+        manifest (pd.DataFrame): The manifest of the last run.
+
+    Returns:
+        Tuple[pd.DataFrame, List[str], List[str]]: The manifest of the current files (rows of changed
+        files are not filled yet), the paths of new or changed files and the paths of removed files.
+    """
+    known = manifest.set_index("path").to_dict("index")
+
+    entries = []
+    changed = []
+    for file_name in sorted(os.listdir(data_dir)):
+        if not file_name.endswith(".dat"):
+            continue
+        fpath = os.path.relpath(os.path.join(data_dir, file_name))
+        stat = os.stat(fpath)
+        entry = {"path": fpath, "size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": None, "rows": None}
+
+        previous = known.get(fpath)
+        if previous is not None and previous["size"] == entry["size"] and previous["mtime"] == entry["mtime"]:
+            entry["hash"], entry["rows"] = previous["hash"], previous["rows"]
+        else:
+            entry["hash"] = file_hash(fpath)
+            if previous is not None and previous["hash"] == entry["hash"]:
+                entry["rows"] = previous["rows"]
+            else:
+                changed.append(fpath)
+        entries.append(entry)
+
+    current = pd.DataFrame(entries, columns=MANIFEST_COLUMNS)
+    removed = sorted(set(known) - set(current["path"]))
+
+    return current, changed, removed
+
+def update_rows(manifest:pd.DataFrame, rows:Dict[str, int]) -> pd.DataFrame:
+    """
+    Fill in the row counts of ingested files. Files without a row count (e.g. because they could not
+    be parsed) get FAILED_ROWS, so scan only reports them again when their size, mtime and hash change.
+    """
+    manifest = manifest.copy()
+    missing = manifest["rows"].isna()
+    manifest.loc[missing, "rows"] = manifest.loc[missing, "path"].map(rows)
+    manifest["rows"] = manifest["rows"].astype("float64").fillna(FAILED_ROWS).astype("int64")
+    return manifest
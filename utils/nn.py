@@ -21,7 +21,7 @@ from sklearn.preprocessing import KBinsDiscretizer, MinMaxScaler, OneHotEncoder
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader, TensorDataset
+from torch.utils.data import DataLoader, Dataset, TensorDataset
 
 import joblib
 
@@ -43,28 +43,140 @@ def project_day_of_week_to_unit_circle(input_day_of_week: int):
     day_of_week_circle_y = (math.cos(alpha) + 1) / 2
     return day_of_week_circle_x, day_of_week_circle_y
 
+def project_dates_to_unit_circle(dates) -> tuple:
+    """ Vectorized version of project_date_to_unit_circle for an array of dates. """
+    days = pd.to_datetime(pd.Series(dates)).values.astype("datetime64[D]")
+    years = days.astype("datetime64[Y]")
+    year = years.astype(np.int64) + 1970
+    passed_days = (days - years.astype("datetime64[D]")).astype(np.int64) + 1
+    is_leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    nr_of_days_per_year = np.where(is_leap, 366, 365)
+    position_within_year = passed_days / nr_of_days_per_year
+    alpha = position_within_year * math.pi * 2
+
+    # There are at most 366 distinct angles per year, sin and cos are only evaluated for those.
+    # math.sin and math.cos are used so the result is identical to project_date_to_unit_circle.
+    unique_alpha, inverse = np.unique(alpha, return_inverse=True)
+    year_circle_x = np.array([(math.sin(a) + 1) / 2 for a in unique_alpha])[inverse]
+    year_circle_y = np.array([(math.cos(a) + 1) / 2 for a in unique_alpha])[inverse]
+    return year_circle_x, year_circle_y
+
+def project_days_of_week_to_unit_circle(days_of_week) -> tuple:
+    """ Vectorized version of project_day_of_week_to_unit_circle for an array of days of the week. """
+    days_of_week = np.asarray(days_of_week, dtype=np.int64)
+    lookup = np.array([project_day_of_week_to_unit_circle(day) for day in range(7)])
+    return lookup[days_of_week, 0], lookup[days_of_week, 1]
+
+def consecutive_window_starts(times: np.ndarray, sequence_length: int, step: pd.Timedelta = pd.Timedelta(days=1)) -> np.ndarray:
+    """ Returns the start positions of all windows of sequence_length consecutive time steps. """
+    times = np.asarray(times, dtype="datetime64[ns]").astype(np.int64)
+    n_windows = len(times) - sequence_length
+    if n_windows <= 0:
+        return np.array([], dtype=np.int64)
+
+    # Same check as (end - start).days == sequence_length - 1 for every window
+    spans = (times[sequence_length - 1:sequence_length - 1 + n_windows] - times[:n_windows]) // step.value
+    return np.flatnonzero(spans == sequence_length - 1)
+
 def create_sequences(data, features, sequence_length):
+    """
+    Create the input sequences (sequence_length - 1 consecutive days) and targets (tmp of the
+    following day) for every room. The windows are taken from a sliding window view of each
+    room's values, so no window is built in Python.
+    """
+    feature_columns = [feature for feature in features if feature != 'room']
     sequences = []
     targets = []
     
     for room in data['room'].unique():
         df_room = data[data['room'] == room].reset_index()
-        for i in range(len(df_room) - sequence_length):
-            # Prüfe, ob die Tage aufeinanderfolgend sind
-            if (df_room.loc[i + sequence_length - 1, 'date_time'] - df_room.loc[i, 'date_time']).days == sequence_length - 1:
-                sequences.append(df_room.loc[i:i+sequence_length-2, features].drop(columns=['room']).values)
-                targets.append(df_room.loc[i + sequence_length -1, 'tmp'])
-    
-    return np.array(sequences), np.array(targets)
+        starts = consecutive_window_starts(df_room['date_time'].values, sequence_length)
+        if len(starts) == 0:
+            continue
+
+        values = df_room[feature_columns].to_numpy()
+        windows = np.lib.stride_tricks.sliding_window_view(values, sequence_length - 1, axis=0)
+        sequences.append(windows[starts].transpose(0, 2, 1))
+        targets.append(df_room['tmp'].to_numpy()[starts + sequence_length - 1])
+
+    if not sequences:
+        return np.array(sequences), np.array(targets)
+
+    return np.concatenate(sequences), np.concatenate(targets)
+
+
+class SequenceDataset(Dataset):
+    """
+    Lazy version of create_sequences.
+
+    Keeps one contiguous array per room (optionally memory-mapped from mmap_dir) and an index of
+    the valid window start positions. The windows are returned as views into these arrays, so the
+    memory does not grow with the sequence length or the number of overlapping windows.
+
+    Args:
+        data (pd.DataFrame): The data with a room column and date_time as index or column.
+        features (list): The feature columns, 'room' is ignored.
+        sequence_length (int): sequence_length - 1 time steps are used to predict the next one.
+        step (pd.Timedelta): The time between two consecutive rows, e.g. one hour for hourly data.
+        target (str): The column to predict.
+        x_scaler (MinMaxScaler): Fitted scaler applied to the features.
+        y_scaler (MinMaxScaler): Fitted scaler applied to the target.
+        mmap_dir (str): Store the arrays of every room in this directory and memory-map them.
+    """
+    def __init__(self, data, features, sequence_length, step=pd.Timedelta(days=1), target='tmp',
+                 x_scaler=None, y_scaler=None, mmap_dir=None):
+        self.sequence_length = sequence_length
+        feature_columns = [feature for feature in features if feature != 'room']
+
+        self.values = []
+        self.targets = []
+        index = []
+        for room in data['room'].unique():
+            df_room = data[data['room'] == room].reset_index()
+            starts = consecutive_window_starts(df_room['date_time'].values, sequence_length, step)
+            if len(starts) == 0:
+                continue
+
+            values = df_room[feature_columns].to_numpy(dtype=np.float64)
+            targets = df_room[target].to_numpy(dtype=np.float64).reshape(-1, 1)
+            if x_scaler is not None:
+                values = x_scaler.transform(values)
+            if y_scaler is not None:
+                targets = y_scaler.transform(targets)
+            values = np.ascontiguousarray(values, dtype=np.float32)
+            targets = np.ascontiguousarray(targets.reshape(-1), dtype=np.float32)
+
+            if mmap_dir is not None:
+                os.makedirs(mmap_dir, exist_ok=True)
+                np.save(os.path.join(mmap_dir, f"{room}_values.npy"), values)
+                np.save(os.path.join(mmap_dir, f"{room}_targets.npy"), targets)
+                # Copy-on-write, so torch gets a writable array without reading the file into memory
+                values = np.load(os.path.join(mmap_dir, f"{room}_values.npy"), mmap_mode="c")
+                targets = np.load(os.path.join(mmap_dir, f"{room}_targets.npy"), mmap_mode="c")
+
+            index.append(np.column_stack([np.full(len(starts), len(self.values)), starts]))
+            self.values.append(values)
+            self.targets.append(targets)
+
+        self.index = np.concatenate(index) if index else np.empty((0, 2), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        room, start = self.index[i]
+        x = self.values[room][start:start + self.sequence_length - 1]
+        y = self.targets[room][start + self.sequence_length - 1]
+        return torch.from_numpy(x), torch.tensor(y)
 
 
 def feature_engineering(df: pd.DataFrame) -> pd.DataFrame:
     """ Feature Engineering for the neural network. """
     # Project the date to a unit circle (year)
-    df['date_circle_x'], df['date_circle_y'] = zip(*df['date'].apply(project_date_to_unit_circle))
+    df['date_circle_x'], df['date_circle_y'] = project_dates_to_unit_circle(df['date'])
 
     # Project the day_of_week to a unit circle (week)
-    df['day_of_week_circle_x'], df['day_of_week_circle_y'] = zip(*df['day_of_week'].apply(project_day_of_week_to_unit_circle))
+    df['day_of_week_circle_x'], df['day_of_week_circle_y'] = project_days_of_week_to_unit_circle(df['day_of_week'])
 
     return df
 
@@ -81,21 +193,24 @@ def encode(df: pd.DataFrame, encoder: OneHotEncoder) -> pd.DataFrame:
 
     return df
     
+# Columns of the daily data the model is trained on
+DAILY_COLUMNS = [
+    'room', 'tmp', 'hum', 'CO2', 'VOC', 'outside_tmp', 'outside_hum', 'outside_rain',
+    'outside_snowfall', 'outside_wind_speed', 'outside_pressure',
+    'date_circle_x', 'date_circle_y', 'day_of_week_circle_x',
+    'day_of_week_circle_y', 'season_autumn', 'season_spring',
+    'season_summer', 'season_winter', 'floor_0', 'floor_1', 'floor_2',
+    'floor_3'
+    ]
+
 def resample(df: pd.DataFrame) -> pd.DataFrame:
     """ Resample the data to daily values. """
     #----- Resampling ----------------------------------------
     df.set_index('date_time', inplace=True)
     
-    df = df[[
-        'room', 'tmp', 'hum', 'CO2', 'VOC', 'outside_tmp', 'outside_hum', 'outside_rain',
-        'outside_snowfall', 'outside_wind_speed', 'outside_pressure',
-        'date_circle_x', 'date_circle_y', 'day_of_week_circle_x',
-        'day_of_week_circle_y', 'season_autumn', 'season_spring',
-        'season_summer', 'season_winter', 'floor_0', 'floor_1', 'floor_2',
-        'floor_3'
-        ]]
+    df = df[DAILY_COLUMNS]
     
-    df_daily = df.groupby('room').resample('D').mean().dropna()
+    df_daily = df.groupby('room', observed=True).resample('D').mean().dropna()
     df_daily.reset_index(inplace=True)
     df_daily.set_index(['date_time'], inplace=True)
     df_daily.drop(['room'], axis=1, inplace=True)
@@ -0,0 +1,132 @@
+import os
+from itertools import groupby
+from typing import List, Tuple
+
+import pandas as pd
+
+import utils.storage
+
+# Hourly and daily aggregates of the processed data per room, stored next to it as Parquet
+# datasets with the same partitioning:
+#   data/processed/rollups/hourly.parquet/room=002/year_month=2022-09/part-0.parquet
+# date_time is the start of the hour or day. For every sensor and weather column there are the
+# columns <column>_mean, <column>_min, <column>_max and <column>_count (number of non-null values).
+
+RESOLUTIONS = {"hourly": "h", "daily": "D"}
+
+ROLLUP_COLUMNS = [
+    "tmp", "hum", "CO2", "VOC",
+    "outside_tmp", "outside_hum", "outside_rain", "outside_snowfall", "outside_wind_speed", "outside_pressure"
+]
+STATISTICS = ["mean", "min", "max", "count"]
+
+# Columns that are constant within an hour (or day) and are kept for filtering
+CARRIED_COLUMNS = {
+    "hourly": ["floor", "date", "month", "hour", "day_of_week", "is_weekend", "season"],
+    "daily": ["floor", "date", "month", "day_of_week", "is_weekend", "season"],
+}
+
+def rollup_dir(output_fpath:str, resolution:str) -> str:
+    """ Returns the directory of the rollup of the processed dataset at output_fpath. """
+    return os.path.join(os.path.dirname(output_fpath), "rollups", f"{resolution}.parquet")
+
+def compute(df:pd.DataFrame, resolution:str) -> pd.DataFrame:
+    """
+    Aggregate processed data per room and hour or day.
+
+    Args:
+        df (pd.DataFrame): The processed data.
+        resolution (str): "hourly" or "daily".
+
+    Returns:
+        pd.DataFrame: One row per room and hour (or day) with readings.
+    """
+    columns = [c for c in ROLLUP_COLUMNS if c in df.columns]
+    carried = [c for c in CARRIED_COLUMNS[resolution] if c in df.columns]
+
+    bucket = df["date_time"].dt.floor(RESOLUTIONS[resolution])
+    grouped = df.groupby([df["room"], bucket], observed=True, sort=True)
+
+    df_stats = grouped[columns].agg(STATISTICS)
+    df_stats.columns = [f"{column}_{statistic}" for column, statistic in df_stats.columns]
+    df_rollup = pd.concat([grouped[carried].first(), df_stats], axis=1).reset_index()
+
+    counts = [f"{column}_count" for column in columns]
+    df_rollup[counts] = df_rollup[counts].astype("int32")
+    return utils.storage.apply_schema(df_rollup)
+
+def update(output_fpath:str, partitions:List[Tuple[str, str]]) -> None:
+    """
+    Recompute the rollups of the given (room, year_month) partitions of the processed data.
+
+    The partitions are read one room at a time. Rollup partitions whose data partition no longer
+    exists are deleted.
+
+    Args:
+        output_fpath (str): The directory of the processed dataset.
+        partitions (List[Tuple[str, str]]): The changed partitions.
+    """
+    for room, room_partitions in groupby(sorted(set(partitions)), key=lambda p: p[0]):
+        room_partitions = list(room_partitions)
+        df = utils.storage.read_partitions(output_fpath, room_partitions)
+
+        for resolution in RESOLUTIONS:
+            dataset_dir = rollup_dir(output_fpath, resolution)
+            if df.empty:
+                utils.storage.delete_partitions(dataset_dir, room_partitions)
+                continue
+
+            df_rollup = compute(df, resolution)
+            utils.storage.write_dataset(df_rollup, dataset_dir)
+            remaining = set(zip(df_rollup["room"], utils.storage.year_month(df_rollup["date_time"])))
+            utils.storage.delete_partitions(dataset_dir, [p for p in room_partitions if p not in remaining])
+
+def rebuild(output_fpath:str) -> None:
+    """ Recompute all rollups of the processed dataset. """
+    for resolution in RESOLUTIONS:
+        utils.storage.delete_dataset(rollup_dir(output_fpath, resolution))
+    update(output_fpath, utils.storage.list_partitions(output_fpath))
+
+def read_rollup(
+        output_fpath:str,
+        resolution:str,
+        room=None,
+        start:pd.Timestamp=None,
+        end:pd.Timestamp=None,
+        columns:List[str]=None
+    ) -> pd.DataFrame:
+    """
+    Read a rollup, the filters work like in utils.storage.read_dataset (on the start of the hour or day).
+
+    Args:
+        output_fpath (str): The directory of the processed dataset.
+        resolution (str): "hourly" or "daily".
+        room (str or List[str]): Only read these rooms.
+        start (pd.Timestamp): Only read hours (or days) starting at or after start.
+        end (pd.Timestamp): Only read hours (or days) starting at or before end.
+        columns (List[str]): Only read these columns.
+    """
+    return utils.storage.read_dataset(rollup_dir(output_fpath, resolution), room=room, start=start, end=end, columns=columns)
+
+def weighted_mean(df_rollup:pd.DataFrame, by, metrics:List[str]) -> pd.DataFrame:
+    """
+    Combine rollup rows to the mean of the underlying readings, e.g. the mean per hour of the day
+    over several rooms and days. Every row is weighted with its number of readings.
+
+    Args:
+        df_rollup (pd.DataFrame): Rows of a rollup.
+        by (str or List[str]): The columns to group by.
+        metrics (List[str]): The columns (without suffix) to average.
+
+    Returns:
+        pd.DataFrame: The group columns and the mean of every metric.
+    """
+    sums = pd.DataFrame({
+        metric: (df_rollup[f"{metric}_mean"].astype("float64") * df_rollup[f"{metric}_count"]).fillna(0) for metric in metrics
+    })
+    counts = pd.DataFrame({metric: df_rollup[f"{metric}_count"] for metric in metrics})
+    keys = [df_rollup[c] for c in ([by] if isinstance(by, str) else by)]
+
+    grouped_sums = sums.groupby(keys, observed=True).sum()
+    grouped_counts = counts.groupby(keys, observed=True).sum()
+    return (grouped_sums / grouped_counts.where(grouped_counts > 0)).reset_index()
@@ -0,0 +1,266 @@
+import os
+import shutil
+import time
+from typing import List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# The processed data is stored as a hive-partitioned Parquet dataset:
+#   data_building_n.parquet/room=002/year_month=2022-09/part-0.parquet
+# Within a file the rows are sorted by date_time, so the row group statistics of date_time can be
+# used to skip data outside of a requested time range. The live ingest appends further files to a
+# partition (part-<time>-0.parquet), which are merged again by compact_partitions.
+#
+# Every function that changes a dataset replaces its _version file afterwards (files starting with
+# "_" are ignored by pyarrow), so readers can tell with a single stat whether a dataset changed.
+VERSION_FNAME = "_version"
+PARTITION_COLUMNS = ["room", "year_month"]
+PARTITIONING = ds.partitioning(
+    pa.schema([("room", pa.dictionary(pa.int32(), pa.string())), ("year_month", pa.dictionary(pa.int32(), pa.string()))]),
+    flavor="hive",
+    dictionaries="infer"
+)
+
+SEASONS = ["winter", "spring", "summer", "autumn"]
+
+# Schema of the processed data. Rooms, floors and seasons only have a handful of distinct values
+# and are stored as categoricals, the calendar fields fit into small integers and float32 is
+# precise enough for all sensor and weather values. The LoRaWAN frame counter (f_cnt) is kept to
+# recognize repeated uplinks across pipeline runs. The date is a date32 instead of an object
+# column of datetime.date.
+PROCESSED_DTYPES = {
+    "date_time": "datetime64[ns]",
+    "room": "category",
+    "floor": "category",
+    "tmp": "float32",
+    "hum": "float32",
+    "CO2": "float32",
+    "VOC": "float32",
+    "f_cnt": "uint32",
+    "date": pd.ArrowDtype(pa.date32()),
+    "month": "int8",
+    "hour": "int8",
+    "day_of_week": "int8",
+    "is_weekend": "bool",
+    "season": pd.CategoricalDtype(SEASONS),
+    "outside_tmp": "float32",
+    "outside_hum": "float32",
+    "outside_rain": "float32",
+    "outside_snowfall": "float32",
+    "outside_wind_speed": "float32",
+    "outside_pressure": "float32",
+}
+
+def apply_schema(df:pd.DataFrame) -> pd.DataFrame:
+    """ Convert the columns of processed data to the dtypes of PROCESSED_DTYPES. """
+    dtypes = {c: dtype for c, dtype in PROCESSED_DTYPES.items() if c in df.columns and df[c].dtype != dtype}
+    return df.astype(dtypes) if dtypes else df
+
+def year_month(date_time:pd.Series) -> pd.Series:
+    """ Returns the year_month partition value (e.g. "2022-09") for every timestamp. """
+    months = date_time.dt.year * 100 + date_time.dt.month
+    labels = {m: f"{m // 100:04d}-{m % 100:02d}" for m in months.unique()}
+    return months.map(labels)
+
+def partition_dir(dataset_dir:str, room:str, ym:str) -> str:
+    """ Returns the directory of a single partition. """
+    return os.path.join(dataset_dir, f"room={room}", f"year_month={ym}")
+
+def version_fpath(dataset_dir:str) -> str:
+    """ Returns the path of the version file of a dataset. """
+    return os.path.join(dataset_dir, VERSION_FNAME)
+
+def touch_version(dataset_dir:str) -> None:
+    """ Mark the dataset as changed. The file is replaced, so its inode and mtime change with every write. """
+    if not os.path.isdir(dataset_dir):
+        return
+    fpath = version_fpath(dataset_dir)
+    with open(fpath + ".tmp", "w") as f:
+        f.write(str(time.time_ns()))
+    os.replace(fpath + ".tmp", fpath)
+
+def delete_dataset(dataset_dir:str) -> None:
+    """ Delete the whole dataset. """
+    if os.path.isdir(dataset_dir):
+        shutil.rmtree(dataset_dir)
+    elif os.path.isfile(dataset_dir):
+        # Processed data of earlier versions was a single Parquet file
+        os.remove(dataset_dir)
+
+def write_dataset(df:pd.DataFrame, dataset_dir:str, overwrite:bool=False, append:bool=False) -> None:
+    """
+    Write processed data to the partitioned dataset.
+
+    Partitions contained in df are replaced completely, all other partitions are kept. In append
+    mode the rows are added as new files to their partitions instead. The file names contain the
+    time of writing, so reading the files in name order keeps the order in which they were appended.
+
+    Args:
+        df (pd.DataFrame): The processed data, needs the columns room and date_time.
+        dataset_dir (str): The directory of the dataset.
+        overwrite (bool): Delete the whole dataset before writing.
+        append (bool): Append df to the existing partitions.
+    """
+    if overwrite or os.path.isfile(dataset_dir):
+        delete_dataset(dataset_dir)
+
+    df = df.assign(year_month=year_month(df["date_time"]))
+    df = df.sort_values(["room", "date_time"], ignore_index=True)
+
+    ds.write_dataset(
+        pa.Table.from_pandas(df, preserve_index=False),
+        dataset_dir,
+        format="parquet",
+        partitioning=PARTITION_COLUMNS,
+        partitioning_flavor="hive",
+        existing_data_behavior="overwrite_or_ignore" if append else "delete_matching",
+        basename_template=f"part-{time.time_ns()}-{{i}}.parquet" if append else "part-{i}.parquet",
+    )
+    touch_version(dataset_dir)
+
+def delete_partitions(dataset_dir:str, partitions:List[Tuple[str, str]]) -> None:
+    """ Delete the given (room, year_month) partitions. """
+    for room, ym in partitions:
+        fpath = partition_dir(dataset_dir, room, ym)
+        if os.path.isdir(fpath):
+            shutil.rmtree(fpath)
+        room_dir = os.path.dirname(fpath)
+        if os.path.isdir(room_dir) and not os.listdir(room_dir):
+            os.rmdir(room_dir)
+    touch_version(dataset_dir)
+
+def read_dataset(
+        dataset_dir:str,
+        room:Union[str, List[str]]=None,
+        start:pd.Timestamp=None,
+        end:pd.Timestamp=None,
+        columns:List[str]=None
+    ) -> pd.DataFrame:
+    """
+    Read the processed data. All filters are pushed down to the dataset, so only the needed
+    partitions, row groups and columns are read.
+
+    Args:
+        dataset_dir (str): The directory of the dataset.
+        room (str or List[str]): Only read these rooms.
+        start (pd.Timestamp): Only read rows with date_time >= start.
+        end (pd.Timestamp): Only read rows with date_time <= end.
+        columns (List[str]): Only read these columns.
+
+    Returns:
+        pd.DataFrame: The data sorted by room and date_time.
+    """
+    dataset = ds.dataset(dataset_dir, format="parquet", partitioning=PARTITIONING)
+
+    conditions = []
+    if room is not None:
+        if isinstance(room, str):
+            conditions.append(ds.field("room") == room)
+        else:
+            conditions.append(ds.field("room").isin(list(room)))
+    if start is not None:
+        start = pd.Timestamp(start)
+        conditions.append(ds.field("year_month") >= start.strftime("%Y-%m"))
+        conditions.append(ds.field("date_time") >= pa.scalar(start, type=pa.timestamp("ns")))
+    if end is not None:
+        end = pd.Timestamp(end)
+        conditions.append(ds.field("year_month") <= end.strftime("%Y-%m"))
+        conditions.append(ds.field("date_time") <= pa.scalar(end, type=pa.timestamp("ns")))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    if columns is None:
+        columns = [c for c in dataset.schema.names if c != "year_month"]
+
+    table = dataset.to_table(columns=columns, filter=expression)
+    df = apply_schema(table.to_pandas())
+    if room is not None and "room" in df.columns:
+        df["room"] = df["room"].cat.remove_unused_categories()
+    return sort_rows(df)
+
+def sort_rows(df:pd.DataFrame) -> pd.DataFrame:
+    """
+    Sort rows by room and date_time, unless they already are. The files of a partition are read one
+    after another, so the rows are only out of order if appended files overlap in time.
+    """
+    if len(df) < 2 or "date_time" not in df.columns:
+        return df
+    times = df["date_time"].to_numpy().view(np.int64)
+    if "room" in df.columns:
+        # Categoricals are sorted in the order of their categories
+        room_diff = np.diff(df["room"].cat.codes.to_numpy().astype(np.int64))
+        ordered = (room_diff > 0) | ((room_diff == 0) & (np.diff(times) >= 0))
+        keys = ["room", "date_time"]
+    else:
+        ordered = np.diff(times) >= 0
+        keys = ["date_time"]
+    if ordered.all():
+        return df
+    return df.sort_values(keys, ignore_index=True, kind="stable")
+
+def read_partitions(dataset_dir:str, partitions:List[Tuple[str, str]], columns:List[str]=None) -> pd.DataFrame:
+    """ Read the given (room, year_month) partitions, optionally only the given columns. """
+    fpaths = []
+    for room, ym in partitions:
+        fpath = partition_dir(dataset_dir, room, ym)
+        if os.path.isdir(fpath):
+            fpaths += [os.path.join(fpath, f) for f in sorted(os.listdir(fpath)) if f.endswith(".parquet")]
+
+    if not fpaths:
+        return pd.DataFrame()
+
+    dataset = ds.dataset(fpaths, format="parquet", partitioning=PARTITIONING, partition_base_dir=dataset_dir)
+    if columns is None:
+        columns = [c for c in dataset.schema.names if c != "year_month"]
+    return apply_schema(dataset.to_table(columns=columns).to_pandas())
+
+def compact_partitions(dataset_dir:str, partitions:List[Tuple[str, str]]) -> None:
+    """
+    Merge the files of the given (room, year_month) partitions into one file sorted by date_time.
+
+    The merged file replaces part-0.parquet, the first file in name order, so files appended later
+    still sort behind it. Readers may briefly see rows twice while the merged files are deleted.
+    """
+    compacted = False
+    for room, ym in partitions:
+        fpath = partition_dir(dataset_dir, room, ym)
+        if not os.path.isdir(fpath):
+            continue
+        fnames = sorted(f for f in os.listdir(fpath) if f.endswith(".parquet"))
+        if len(fnames) < 2:
+            continue
+        compacted = True
+
+        table = ds.dataset([os.path.join(fpath, f) for f in fnames], format="parquet").to_table()
+        table = table.sort_by("date_time")
+        tmp_fpath = os.path.join(fpath, ".part-0.parquet.tmp")
+        pq.write_table(table, tmp_fpath)
+        os.replace(tmp_fpath, os.path.join(fpath, "part-0.parquet"))
+        for f in fnames:
+            if f != "part-0.parquet":
+                os.remove(os.path.join(fpath, f))
+    if compacted:
+        touch_version(dataset_dir)
+
+def list_partitions(dataset_dir:str) -> List[Tuple[str, str]]:
+    """ Returns all (room, year_month) partitions of the dataset. """
+    if not os.path.isdir(dataset_dir):
+        return []
+    partitions = []
+    for room_dir in sorted(os.listdir(dataset_dir)):
+        if not room_dir.startswith("room="):
+            continue
+        for ym_dir in sorted(os.listdir(os.path.join(dataset_dir, room_dir))):
+            if ym_dir.startswith("year_month="):
+                partitions.append((room_dir[len("room="):], ym_dir[len("year_month="):]))
+    return partitions
+
+def list_rooms(dataset_dir:str) -> List[str]:
+    """ Returns all rooms of the dataset, based on the partition directories. """
+    return sorted(d[len("room="):] for d in os.listdir(dataset_dir) if d.startswith("room="))
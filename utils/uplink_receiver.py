@@ -0,0 +1,438 @@
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+
+current_dir = os.getcwd()
+git_root = subprocess.check_output(["git", "rev-parse", "--show-toplevel"], cwd=current_dir)
+git_root = git_root.decode("utf-8").strip()
+os.chdir(git_root)
+sys.path.append(git_root)
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+from colorama import Fore, Style
+
+import utils.data_pipeline
+import utils.ingest
+import utils.weather
+
+# HTTP endpoint for uplinks forwarded by a TTN/TTS webhook. The body of POST /uplink is either
+# one uplink or a list of uplinks, each in the TTS v3 format
+#   {"end_device_ids": {"device_id": "hka-aqm-n002"}, "received_at": "2024-05-01T12:00:00.123Z",
+#    "uplink_message": {"f_cnt": 2, "decoded_payload": {"tmp": 23.4, "hum": 55.7, "CO2": 585, "VOC": 450}}}
+# or flat with the columns of the .dat files ({"date_time": "2024-05-01 14:00:00", "device_id": ..., "f_cnt": ...}).
+# The uplinks are buffered and written to the processed data in micro-batches.
+
+SENSOR_COLUMNS = ["tmp", "hum", "CO2", "VOC"]
+
+# The devices of the building, the first digit of the room is the floor (see utils.data_pipeline.add_features)
+DEVICE_PATTERN = re.compile(r"hka-aqm-n\d\w*")
+
+# A batch of 5000 uplinks in the TTS format is about 2 MB
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+def parse_time(value, utc:bool) -> Tuple[int, bool]:
+    """
+    Parse a timestamp into nanoseconds since the epoch and whether they are UTC (True) or local
+    time (False). Timestamps with an offset are UTC, naive ones are taken as UTC if utc is set and
+    as local time otherwise. The conversion to local time is done for the whole batch in records_to_table.
+
+    Raises:
+        ValueError: If the value is not a valid timestamp.
+    """
+    timestamp = pd.Timestamp(str(value))
+    if pd.isna(timestamp):
+        raise ValueError(f"Invalid timestamp {value!r}")
+    return timestamp.value, utc or timestamp.tzinfo is not None
+
+def parse_uplink(uplink:dict) -> Tuple:
+    """
+    Convert an uplink to a record (date_time, is_utc, device_id, tmp, hum, CO2, VOC, f_cnt), see parse_time.
+
+    Raises:
+        KeyError, TypeError, ValueError: If a field is missing, has the wrong type or an invalid
+            value (a timestamp that can not be parsed, a device of another building, a frame
+            counter outside of 32 bits).
+    """
+    if "uplink_message" in uplink:
+        message = uplink["uplink_message"]
+        payload = message["decoded_payload"]
+        date_time = parse_time(uplink["received_at"], utc=True)
+        device_id = str(uplink["end_device_ids"]["device_id"])
+        values = [payload.get(c) for c in SENSOR_COLUMNS]
+        f_cnt = int(message.get("f_cnt", 0))
+    else:
+        date_time = parse_time(uplink["date_time"], utc=False)
+        device_id = str(uplink["device_id"])
+        values = [uplink.get(c) for c in SENSOR_COLUMNS]
+        f_cnt = int(uplink["f_cnt"])
+
+    if not DEVICE_PATTERN.fullmatch(device_id):
+        raise ValueError(f"Unknown device {device_id!r}")
+    if not 0 <= f_cnt < 2 ** 32:
+        raise ValueError(f"Invalid f_cnt {f_cnt}")
+    return (*date_time, device_id, *(float(v) if v is not None else None for v in values), f_cnt)
+
+def records_to_table(records:List[Tuple]) -> pa.Table:
+    """ Convert buffered records to an Arrow table with the raw columns of the .dat files. """
+    date_time, is_utc, device_id, tmp, hum, co2, voc, f_cnt = zip(*records)
+
+    # TTS timestamps are UTC, the .dat files and the processed data use the local time
+    date_time = pd.Series(pd.to_datetime(date_time, unit="ns"))
+    is_utc = pd.Series(is_utc)
+    if is_utc.any():
+        utc = date_time[is_utc].dt.tz_localize("UTC")
+        date_time[is_utc] = utc.dt.tz_convert(utils.weather.TIMEZONE).dt.tz_localize(None)
+
+    return pa.Table.from_pydict({
+        "date_time": date_time,
+        "device_id": pa.array(device_id, pa.string()),
+        "tmp": pa.array(tmp, pa.float64()),
+        "hum": pa.array(hum, pa.float64()),
+        "CO2": pa.array(co2, pa.float64()),
+        "VOC": pa.array(voc, pa.float64()),
+        "f_cnt": pa.array(f_cnt, pa.int64()),
+    })
+
+def parse_head(head:bytes) -> Tuple[str, str, Dict[str, str]]:
+    """
+    Parse the request line and headers of an HTTP/1.1 request into (method, path, headers) with
+    lower case header names. The values of repeated headers are joined with commas.
+
+    Raises:
+        ValueError: If the request line is malformed.
+    """
+    request_line, *header_lines = head.decode("latin-1").split("\r\n")
+    method, path, version = request_line.split(" ", 2)
+    if not version.startswith("HTTP/"):
+        raise ValueError(f"Unexpected request line {request_line!r}")
+
+    headers = {}
+    for line in header_lines:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            name, value = name.strip().lower(), value.strip()
+            headers[name] = f"{headers[name]}, {value}" if name in headers else value
+    return method, path, headers
+
+def check_body_size(headers:Dict[str, str], max_body_size:int) -> Optional[int]:
+    """
+    Returns the status code to reject the request with if its body can not be read, otherwise None.
+
+    A missing Content-Length means there is no body. Bodies with a Transfer-Encoding are not
+    supported: chunked requests are asked to send a Content-Length (411), others are refused (501).
+    """
+    if "transfer-encoding" in headers:
+        return 411 if headers["transfer-encoding"].lower() == "chunked" else 501
+    length = headers.get("content-length", "0")
+    if not length.isdigit():
+        return 400
+    if int(length) > max_body_size:
+        return 413
+    return None
+
+class UplinkReceiver:
+    """
+    Receives uplinks over HTTP and writes them to the processed data in micro-batches.
+
+    The buffer is flushed as soon as it holds batch_size uplinks or its oldest uplink is older than
+    flush_interval seconds. Flushes run one after another on a worker thread, so the event loop keeps
+    accepting uplinks while a batch is written. If more than max_buffered uplinks are waiting
+    (buffered or being written), requests are answered with 503 and a Retry-After header. The rollups,
+    device health and CO2 episodes of the written partitions are updated every derived_interval
+    seconds (see utils.ingest.update_derived).
+
+    Args:
+        output_fpath (str): The directory of the processed dataset.
+        batch_size (int): Number of uplinks that triggers a flush.
+        flush_interval (float): Maximum seconds an uplink waits in the buffer.
+        max_buffered (int): Number of waiting uplinks from which on requests are rejected.
+        weather_interval (float): Minimum seconds between two updates of the weather data, see utils.ingest.watch.
+        derived_interval (float): Seconds between two updates of the rollups, device health and CO2 episodes.
+        max_body_size (int): Maximum size of a request body in bytes, larger requests are answered with 413.
+    """
+
+    def __init__(
+            self,
+            output_fpath:str="data/processed/data_building_n.parquet",
+            batch_size:int=5000,
+            flush_interval:float=2.0,
+            max_buffered:int=50000,
+            weather_interval:float=300.0,
+            derived_interval:float=60.0,
+            max_body_size:int=MAX_BODY_SIZE
+        ):
+        self.output_fpath = output_fpath
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.weather_interval = weather_interval
+        self.derived_interval = derived_interval
+        self.max_body_size = max_body_size
+
+        self.buffer = []
+        self.buffer_time = None
+        self.in_flight = 0
+        self.flushing = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.df_weather = None
+        self.weather_time = 0.0
+        self.derived_time = time.monotonic()
+
+    def accept(self, uplinks:List[dict]) -> int:
+        """ Buffer the uplinks. Returns the HTTP status code of the request. """
+        if len(self.buffer) + self.in_flight + len(uplinks) > self.max_buffered:
+            return 503
+
+        try:
+            records = [parse_uplink(uplink) for uplink in uplinks]
+        except (KeyError, TypeError, ValueError):
+            return 400
+
+        if not self.buffer:
+            self.buffer_time = time.monotonic()
+        self.buffer.extend(records)
+        if len(self.buffer) >= self.batch_size:
+            self.start_flush()
+        return 202
+
+    def start_flush(self) -> None:
+        """ Hand the buffer over to the worker thread, unless a flush is already running. """
+        if self.flushing is None and self.buffer:
+            self.flushing = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self) -> None:
+        records, self.buffer = self.buffer, []
+        self.in_flight = len(records)
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.write, records)
+        except Exception as e:
+            print(Fore.RED + f"Dropped {len(records)} uplinks: {e}")
+            print(Style.RESET_ALL)
+        finally:
+            self.in_flight = 0
+            self.flushing = None
+        if len(self.buffer) >= self.batch_size:
+            self.start_flush()
+
+    def write(self, records:List[Tuple]) -> None:
+        """ Validate, process and append the records to the processed data (runs on the worker thread). """
+        start = time.time()
+        rows = self.ingest(records)
+        print(f"✓ Stored {rows} of {len(records)} uplinks in {time.time() - start:.1f}s")
+        self.update_derived()
+
+    def ingest(self, records:List[Tuple]) -> int:
+        """
+        Append the records to the processed data. If records can not be processed, the batch is
+        split in halves until only the failing records are left, which are dropped.
+
+        Returns:
+            int: The number of appended rows.
+        """
+        try:
+            table = records_to_table(records)
+            self.refresh_weather(table)
+            return utils.ingest.ingest_batch([table], self.output_fpath, self.df_weather)
+        except (KeyError, TypeError, ValueError, pa.ArrowException) as e:
+            if len(records) == 1:
+                print(Fore.RED + f"Dropped uplink {records[0]}: {e}")
+                print(Style.RESET_ALL)
+                return 0
+        middle = len(records) // 2
+        return self.ingest(records[:middle]) + self.ingest(records[middle:])
+
+    def refresh_weather(self, table:pa.Table) -> None:
+        """ Fetch the recent weather if it lacks the hour of the newest record, at most every weather_interval seconds. """
+        if utils.ingest.weather_missing(self.df_weather, [table]) and time.time() - self.weather_time > self.weather_interval:
+            self.df_weather = utils.ingest.recent_weather()
+            self.weather_time = time.time()
+
+    def update_derived(self, force:bool=False) -> None:
+        """ Update the derived tables if derived_interval has passed (runs on the worker thread). """
+        if not force and time.monotonic() - self.derived_time < self.derived_interval:
+            return
+        self.derived_time = time.monotonic()
+        start = time.time()
+        if utils.ingest.update_derived(self.output_fpath):
+            print(f"✓ Updated rollups, health and events in {time.time() - start:.1f}s")
+
+    async def refresh(self) -> None:
+        """ Update the derived tables while no uplinks arrive. """
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.update_derived)
+        except Exception as e:
+            print(Fore.RED + f"Updating the derived tables failed: {e}")
+            print(Style.RESET_ALL)
+        finally:
+            self.flushing = None
+        if len(self.buffer) >= self.batch_size:
+            self.start_flush()
+
+    async def flush_loop(self) -> None:
+        """ Flush buffers that are older than flush_interval and update the derived tables when due. """
+        while True:
+            await asyncio.sleep(self.flush_interval / 4)
+            if self.buffer and time.monotonic() - self.buffer_time >= self.flush_interval:
+                self.start_flush()
+            elif self.flushing is None and time.monotonic() - self.derived_time >= self.derived_interval:
+                self.flushing = asyncio.get_running_loop().create_task(self.refresh())
+
+    async def handle(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> None:
+        """
+        Serve the requests of one (keep-alive) connection.
+
+        Only bodies with a Content-Length are read. If the body of a request can not be delimited
+        (no valid Content-Length, a Transfer-Encoding) or is too large, the request is rejected and
+        the connection closed, as the next request can not be found in the stream.
+        """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    writer.write(CLOSE_RESPONSES[431])
+                    break
+
+                try:
+                    method, path, headers = parse_head(head)
+                except ValueError:
+                    writer.write(CLOSE_RESPONSES[400])
+                    break
+                status = check_body_size(headers, self.max_body_size)
+                if status is not None:
+                    writer.write(CLOSE_RESPONSES[status])
+                    break
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if path != "/uplink":
+                    status = 404
+                elif method != "POST":
+                    status = 405
+                else:
+                    try:
+                        uplinks = json.loads(body)
+                    except ValueError:
+                        status = 400
+                    else:
+                        status = self.accept(uplinks if isinstance(uplinks, list) else [uplinks])
+
+                writer.write(RESPONSES[status])
+                if headers.get("connection", "").lower() == "close":
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host:str="0.0.0.0", port:int=8080) -> None:
+        """ Accept uplinks until the task is cancelled, the buffer is flushed before returning. """
+        # Partitions left over from a previous run
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.update_derived, True)
+        server = await asyncio.start_server(self.handle, host, port)
+        flush_task = asyncio.get_running_loop().create_task(self.flush_loop())
+
+        print(Style.BRIGHT + Fore.LIGHTMAGENTA_EX + f"Receiving uplinks on http://{host}:{port}/uplink")
+        print(Style.RESET_ALL)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            flush_task.cancel()
+            while self.flushing is not None or self.buffer:
+                if self.flushing is None:
+                    self.start_flush()
+                await self.flushing
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.update_derived, True)
+
+def response(status:int, reason:str, headers:str="") -> bytes:
+    return f"HTTP/1.1 {status} {reason}\r\nContent-Length: 0\r\n{headers}\r\n".encode("latin-1")
+
+RESPONSES = {
+    202: response(202, "Accepted"),
+    400: response(400, "Bad Request"),
+    404: response(404, "Not Found"),
+    405: response(405, "Method Not Allowed"),
+    503: response(503, "Service Unavailable", "Retry-After: 1\r\n"),
+}
+
+# Answers after which the connection is closed
+CLOSE_RESPONSES = {
+    status: response(status, reason, "Connection: close\r\n") for status, reason in [
+        (400, "Bad Request"),
+        (411, "Length Required"),
+        (413, "Content Too Large"),
+        (431, "Request Header Fields Too Large"),
+        (501, "Not Implemented"),
+    ]
+}
+
+def fake_uplinks(devices:List[str], start:pd.Timestamp=None) -> Iterator[dict]:
+    """
+    Generate TTS uplinks with plausible sensor values, one per device and minute, for testing.
+
+    Args:
+        devices (List[str]): The device ids, e.g. ["hka-aqm-n002"].
+        start (pd.Timestamp): The UTC time of the first uplinks. Defaults to now.
+    """
+    received_at = pd.Timestamp.now(tz="UTC") if start is None else pd.Timestamp(start, tz="UTC")
+    f_cnt = {device: random.randint(0, 1000) for device in devices}
+    while True:
+        for device in devices:
+            f_cnt[device] += 1
+            yield {
+                "end_device_ids": {"device_id": device},
+                "received_at": received_at.isoformat().replace("+00:00", "Z"),
+                "uplink_message": {
+                    "f_cnt": f_cnt[device],
+                    "decoded_payload": {
+                        "tmp": round(random.gauss(22, 2), 2),
+                        "hum": round(random.gauss(50, 8), 2),
+                        "CO2": random.randint(400, 1600),
+                        "VOC": random.randint(50, 600),
+                    },
+                },
+            }
+        received_at += pd.Timedelta(minutes=1)
+
+async def send_fake_uplinks(n:int, host:str="127.0.0.1", port:int=8080, connections:int=8, devices:List[str]=None) -> float:
+    """
+    Post n fake uplinks to a receiver over keep-alive connections.
+
+    Returns:
+        float: The number of accepted uplinks per second.
+    """
+    devices = devices or [f"hka-aqm-n{room:03d}" for room in range(1, 51)]
+    uplinks = fake_uplinks(devices)
+    remaining = [n]
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            body = json.dumps(next(uplinks)).encode()
+            while True:
+                writer.write(f"POST /uplink HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+                head = await reader.readuntil(b"\r\n\r\n")
+                if not head.startswith(b"HTTP/1.1 503"):
+                    break
+                await asyncio.sleep(1)
+        writer.close()
+
+    start = time.time()
+    await asyncio.gather(*(client() for _ in range(connections)))
+    return n / (time.time() - start)
+
+if __name__ == "__main__":
+    asyncio.run(UplinkReceiver().serve())
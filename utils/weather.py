@@ -1,12 +1,18 @@
+import os
 import time
+import numpy as np
 import openmeteo_requests
 import requests_cache
 import pandas as pd
 from retry_requests import retry
 
+# Responses of the last days can be incomplete, so they are only cached for an hour. Complete days
+# are kept in the weather store and not requested again anyway.
+CACHE_EXPIRY = 3600
+
 def setup_openmeteo_client():
     """Setup the Open-Meteo API client with cache and retry on error."""
-    cache_session = requests_cache.CachedSession('.cache', expire_after=-1)
+    cache_session = requests_cache.CachedSession('.cache', expire_after=CACHE_EXPIRY)
     retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
     return openmeteo_requests.Client(session=retry_session)
 
@@ -24,60 +30,156 @@ def fetch_weather_data(client, latitude, longitude, start_date, end_date, timezo
     }
     return client.weather_api(url, params=params)
 
-def process_response(response):
-    print("Processing weather data...")
-    """Process the response and convert it to a DataFrame."""
+WEATHER_COLUMNS = ["outside_tmp", "outside_hum", "outside_rain", "outside_snowfall", "outside_wind_speed", "outside_pressure"]
+VARIABLES = "temperature_2m,relative_humidity_2m,rain,snowfall,wind_speed_10m,pressure_msl"
+TIMEZONE = "Europe/Berlin"
+WEATHER_STORE_DIR = "data/weather"
 
+def response_to_hourly(response) -> pd.DataFrame:
+    """Convert the response to a DataFrame with the UTC start of every hour and the weather values."""
     hourly = response.Hourly()
     data = {
-        "date": pd.date_range(
+        "time": pd.date_range(
             start=pd.to_datetime(hourly.Time(), unit="s", utc=True),
             end=pd.to_datetime(hourly.TimeEnd(), unit="s", utc=True),
             freq=pd.Timedelta(seconds=hourly.Interval()),
             inclusive="left"
-        ),
-        "outside_tmp": hourly.Variables(0).ValuesAsNumpy().astype(float),
-        "outside_hum": hourly.Variables(1).ValuesAsNumpy().astype(float),
-        "outside_rain": hourly.Variables(2).ValuesAsNumpy().astype(float),
-        "outside_snowfall": hourly.Variables(3).ValuesAsNumpy().astype(float),
-        "outside_wind_speed": hourly.Variables(4).ValuesAsNumpy().astype(float),
-        "outside_pressure": hourly.Variables(5).ValuesAsNumpy().astype(float),
+        )
     }
+    for i, column in enumerate(WEATHER_COLUMNS):
+        data[column] = hourly.Variables(i).ValuesAsNumpy().astype(float).round(3)
 
-    df = pd.DataFrame(data)
-    df["date"] = pd.to_datetime(df["date"]).dt.tz_convert('Europe/Berlin')
+    return pd.DataFrame(data)
+
+def hourly_to_date_hour(df:pd.DataFrame) -> pd.DataFrame:
+    """Replace the UTC time with the local date and hour."""
+    df = df.copy()
+    df["date"] = df["time"].dt.tz_convert(TIMEZONE)
     df["hour"] = df["date"].dt.hour
     df["date"] = df["date"].dt.date.astype(object)
 
-    for column in ["outside_tmp", "outside_hum", "outside_rain", "outside_snowfall", "outside_wind_speed", "outside_pressure"]:
-        df[column] = df[column].astype(float)
-    
-    df["outside_tmp"] = df["outside_tmp"].round(3)
-    df["outside_hum"] = df["outside_hum"].round(3)
-    df["outside_rain"] = df["outside_rain"].round(3)
-    df["outside_snowfall"] = df["outside_snowfall"].round(3)
-    df["outside_wind_speed"] = df["outside_wind_speed"].round(3)
-    df["outside_pressure"] = df["outside_pressure"].round(3)
+    return df[["date", "hour"] + WEATHER_COLUMNS].reset_index(drop=True)
+
+def hour_key(time:pd.Series) -> np.ndarray:
+    """Returns the number of hours since the epoch (UTC) for timezone aware timestamps."""
+    return time.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy(dtype="datetime64[ns]").astype(np.int64) // 3_600_000_000_000
+
+def local_hour_key(date_time:pd.Series, groups:pd.Series=None) -> np.ndarray:
+    """
+    Returns the number of hours since the epoch (UTC) for naive local timestamps of the sensors.
+
+    The timezone conversion is only done once per distinct local hour. In the night of the change
+    to winter time the hour 02:00-03:00 occurs twice. The loggers write the readings in order, so
+    for every device (groups) the readings of that hour after the clock jumped back are in winter
+    time, the ones before in summer time.
+    """
+    inverse, unique_hours = pd.factorize(date_time.to_numpy(dtype="datetime64[h]").astype("datetime64[ns]"))
+    localized = pd.Series(unique_hours).dt.tz_localize(TIMEZONE, ambiguous="NaT", nonexistent="shift_forward")
+    keys = hour_key(localized)[inverse]
+
+    ambiguous = localized.isna().to_numpy()[inverse] & date_time.notna().to_numpy()
+    if ambiguous.any():
+        df_ambiguous = pd.DataFrame({
+            "date_time": date_time[ambiguous].to_numpy(),
+            "group": groups[ambiguous].to_numpy() if groups is not None else 0,
+        })
+        df_ambiguous["date"] = df_ambiguous["date_time"].dt.normalize()
+        jumped_back = df_ambiguous.groupby(["group", "date"], observed=True)["date_time"].diff() < pd.Timedelta(0)
+        is_winter_time = jumped_back.groupby([df_ambiguous["group"], df_ambiguous["date"]], observed=True).cummax()
+
+        localized_ambiguous = df_ambiguous["date_time"].dt.tz_localize(TIMEZONE, ambiguous=~is_winter_time.to_numpy())
+        keys[ambiguous] = hour_key(localized_ambiguous)
+
+    return keys
+
+def process_response(response):
+    print("Processing weather data...")
+    """Process the response and convert it to a DataFrame."""
+    return hourly_to_date_hour(response_to_hourly(response))
+
+def store_fpath(latitude:float, longitude:float, store_dir:str=WEATHER_STORE_DIR) -> str:
+    """Returns the path of the local weather store of a location."""
+    return os.path.join(store_dir, f"weather_{latitude:.4f}_{longitude:.4f}.parquet")
+
+def read_store(fpath:str) -> pd.DataFrame:
+    """Read the local weather store, an empty store is returned if it does not exist yet."""
+    if not os.path.exists(fpath):
+        return pd.DataFrame({"time": pd.Series(dtype="datetime64[ns, UTC]"), **{c: pd.Series(dtype=float) for c in WEATHER_COLUMNS}})
+    return pd.read_parquet(fpath)
+
+def missing_ranges(df_store:pd.DataFrame, start_date:str, end_date:str) -> list:
+    """
+    Returns the (start_date, end_date) ranges of local dates that are not completely in the store.
+
+    A date counts as available if the store has at least 23 hours of it (the day of the change to
+    summer time only has 23 hours).
+    """
+    dates = pd.date_range(start_date, end_date, freq="D").date
+    local_dates = df_store["time"].dt.tz_convert(TIMEZONE).dt.date
+    hours_per_date = local_dates.value_counts()
+    available = set(hours_per_date[hours_per_date >= 23].index)
+
+    ranges = []
+    for date in dates:
+        if date in available:
+            continue
+        if ranges and (date - ranges[-1][1]).days == 1:
+            ranges[-1][1] = date
+        else:
+            ranges.append([date, date])
 
-    df = df[["date", "hour", "outside_tmp", "outside_hum", "outside_rain", "outside_snowfall", "outside_wind_speed", "outside_pressure"]]
+    return [(start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")) for start, end in ranges]
 
-    return df
+def get_weather_hourly(latitude:float, longitude:float, start_date:str, end_date:str, store_dir:str=WEATHER_STORE_DIR) -> pd.DataFrame:
+    """
+    Get the hourly weather data for the local dates start_date to end_date.
 
-def get_weather_with_api(latitude:float, longitude:float, start_date:str, end_date:str) -> pd.DataFrame:
-    """Main function to fetch and process weather data."""
-    openmeteo_client = setup_openmeteo_client()
-    
+    The hourly weather data is kept in a local Parquet store per location. Only date ranges that
+    are missing in the store are requested from the API, everything else is served offline. If the
+    API can not be reached the available data is returned and the missing hours stay empty.
+
+    Returns:
+        pd.DataFrame: The UTC time, the hour_key (hours since the epoch) and the weather values, sorted by time.
+    """
     if not latitude:
         latitude = 49.014920
     if not longitude:
         longitude = 8.390050
-    
-    timezone = "Europe/Berlin"
-    variables = "temperature_2m,relative_humidity_2m,rain,snowfall,wind_speed_10m,pressure_msl"
 
-    responses = fetch_weather_data(openmeteo_client, latitude, longitude, start_date, end_date, timezone, variables)
-    response = responses[0]
-    hourly_dataframe = process_response(response)
+    fpath = store_fpath(latitude, longitude, store_dir)
+    df_store = read_store(fpath)
+
+    ranges = missing_ranges(df_store, start_date, end_date)
+    if ranges:
+        openmeteo_client = setup_openmeteo_client()
+        df_fetched = []
+        for range_start, range_end in ranges:
+            try:
+                responses = fetch_weather_data(openmeteo_client, latitude, longitude, range_start, range_end, TIMEZONE, VARIABLES)
+            except Exception as e:
+                print(f"Could not fetch weather data from {range_start} to {range_end}: {e}")
+                continue
+            df_fetched.append(response_to_hourly(responses[0]))
+
+        if df_fetched:
+            # Hours the archive does not have yet (the last days) are not stored, so they are requested again next time
+            df_fetched = pd.concat(df_fetched, ignore_index=True).dropna(subset=WEATHER_COLUMNS, how="all")
+            df_store = pd.concat([df_store, df_fetched], ignore_index=True)
+            df_store = df_store.drop_duplicates(subset="time", keep="last").sort_values("time", ignore_index=True)
+            os.makedirs(os.path.dirname(fpath), exist_ok=True)
+            df_store.to_parquet(fpath, index=False)
+
+    local_dates = df_store["time"].dt.tz_convert(TIMEZONE).dt.date
+    in_range = (local_dates >= pd.Timestamp(start_date).date()) & (local_dates <= pd.Timestamp(end_date).date())
+    df_hourly = df_store[in_range].reset_index(drop=True)
+    df_hourly.insert(1, "hour_key", hour_key(df_hourly["time"]))
+
+    return df_hourly
+
+def get_weather_with_api(latitude:float, longitude:float, start_date:str, end_date:str, store_dir:str=WEATHER_STORE_DIR) -> pd.DataFrame:
+    """Main function to fetch and process weather data. Returns the weather with local date and hour."""
+    df_hourly = get_weather_hourly(latitude, longitude, start_date, end_date, store_dir=store_dir)
+    hourly_dataframe = hourly_to_date_hour(df_hourly)
   
     return hourly_dataframe
 